@@ -1,10 +1,19 @@
 from django.contrib import admin
+
+from . import deletion
 from .models import User, UserProfile, Post, Comment, Hashtag, Notification, Follow
 
 
 @admin.register(User)
 class PostAdmin(admin.ModelAdmin):
     list_display = ("username", "first_name", "last_name", "email", "is_staff")
+    actions = ["delete_in_background"]
+
+    @admin.action(description="Delete selected accounts in the background")
+    def delete_in_background(self, request, queryset):
+        for user in queryset:
+            deletion.request_account_deletion(user)
+        self.message_user(request, f"Queued {len(queryset)} accounts for deletion.")
 
 
 @admin.register(Post)
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class BaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'base'
+
+    def ready(self):
+        from .db import configure_sqlite
+        from .metrics import install_query_recorder
+
+        connection_created.connect(configure_sqlite, dispatch_uid='base.db.configure_sqlite')
+        connection_created.connect(install_query_recorder, dispatch_uid='base.metrics.install_query_recorder')
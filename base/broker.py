@@ -0,0 +1,151 @@
+"""
+Publish/subscribe of live notification messages to the open event streams.
+
+Subscribers are asyncio queues living on the event loop of an ASGI worker. The backend
+is chosen with the NOTIFICATION_BROKER setting:
+
+- InProcessBroker only reaches streams served by the process that publishes.
+- FileBroker appends every message to a spool file that every worker process tails,
+  so messages published by process_notifications or another worker reach all streams.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import tempfile
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class InProcessBroker:
+    def __init__(self, **options):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def publish(self, channel, message):
+        """Deliver ``message`` to the subscribers of ``channel``. Safe to call from any thread."""
+        self.dispatch(channel, message)
+
+    def dispatch(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            with contextlib.suppress(RuntimeError):  # The loop was closed meanwhile
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, channel):
+        """Yield an asyncio queue receiving the messages published to ``channel``."""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self.lock:
+                self.subscribers[channel].discard(subscriber)
+                if not self.subscribers[channel]:
+                    del self.subscribers[channel]
+
+
+class FileBroker(InProcessBroker):
+    """
+    Fan messages out across processes on one host through an append-only spool file.
+
+    Every event loop with open streams polls the file in one task, stopped with its last
+    stream. The file is truncated once it grows over ``max_bytes``; a reader that was
+    behind at that moment loses the messages it had not read yet.
+    """
+
+    def __init__(self, path=None, poll_interval=0.5, max_bytes=1024 * 1024, **options):
+        super().__init__(**options)
+        self.path = path or os.path.join(tempfile.gettempdir(), 'photoshare-notifications.jsonl')
+        self.poll_interval = poll_interval
+        self.max_bytes = max_bytes
+        self.tails = {}
+
+    def publish(self, channel, message):
+        line = json.dumps({'channel': channel, 'message': message}) + '\n'
+        with open(self.path, 'a', encoding='utf-8') as spool:
+            if fcntl:
+                fcntl.flock(spool, fcntl.LOCK_EX)
+            if spool.tell() > self.max_bytes:
+                spool.truncate(0)
+            spool.write(line)
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, channel):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            # A loop closed under its streams, on a worker shutdown, never unsubscribes them
+            for closed in [other for other in self.tails if other.is_closed()]:
+                del self.tails[closed]
+            task, subscribers = self.tails.get(loop, (None, 0))
+            if task is None or task.done():
+                task = loop.create_task(self.tail())
+            self.tails[loop] = (task, subscribers + 1)
+        try:
+            async with super().subscribe(channel) as queue:
+                yield queue
+        finally:
+            # The tail stops with the last stream of its loop. Under WSGI every stream runs on
+            # a loop of its own that is closed when the response ends.
+            with self.lock:
+                task, subscribers = self.tails[loop]
+                if subscribers > 1:
+                    self.tails[loop] = (task, subscribers - 1)
+                else:
+                    del self.tails[loop]
+                    task.cancel()
+
+    def spool_size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return None
+
+    def read(self, position, size):
+        try:
+            with open(self.path, 'rb') as spool:
+                spool.seek(position)
+                return spool.read(size - position)
+        except OSError:
+            return b''
+
+    async def tail(self):
+        """Dispatch the lines appended to the spool file to the subscribers of this process."""
+        # The file is polled in a thread, not to block the event loop on the disk
+        position = await asyncio.to_thread(self.spool_size) or 0
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            size = await asyncio.to_thread(self.spool_size)
+            if size is None:
+                continue
+            if size < position:
+                position = 0
+            if size == position:
+                continue
+
+            data = await asyncio.to_thread(self.read, position, size)
+            # Leave a partially written last line for the next round
+            complete = data.rfind(b'\n') + 1
+            position += complete
+            for line in data[:complete].splitlines():
+                with contextlib.suppress(ValueError, KeyError):
+                    event = json.loads(line)
+                    self.dispatch(event['channel'], event['message'])
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    config = getattr(settings, 'NOTIFICATION_BROKER', {})
+    backend = import_string(config.get('BACKEND', 'base.broker.InProcessBroker'))
+    return backend(**config.get('OPTIONS', {}))
@@ -0,0 +1,97 @@
+"""
+Conditional GET and HTTP caching of pages.
+
+A page's ETag is computed from the rows it shows (their updated_at and counters), the
+version of the requesting user and the site version. The views fetch those rows before
+rendering and keep them for the template, so an unchanged page is answered with 304
+without running the rest of its queries, and a changed one costs no extra query.
+
+The user version changes whenever something only visible to that user changes: their
+likes, follows, counters and unread notifications. Pages of logged-in users also depend
+on their CSRF secret, which the tokens of their forms are derived from. The site version changes on rare
+edits shown on every page, such as usernames and avatars. Both are kept in the default
+cache, which has to be shared by all processes for the validators to be correct.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, quote_etag
+from django.utils.http import http_date
+
+ANONYMOUS_MAX_AGE = getattr(settings, 'HTTP_CACHE_ANONYMOUS_MAX_AGE', 30)
+SITE_VERSION_KEY = 'site-version'
+
+
+def user_version_key(user_id):
+    return f'user-version:{user_id}'
+
+
+def get_version(key):
+    # A missing version is replaced by a new one, so evicting it only costs a cache miss
+    return cache.get_or_set(key, lambda: uuid.uuid4().hex, None)
+
+
+def bump_user_versions(*user_ids):
+    cache.delete_many([user_version_key(user_id) for user_id in user_ids])
+
+
+def bump_site_version():
+    cache.delete(SITE_VERSION_KEY)
+
+
+class ConditionalGetMixin:
+    """
+    Mixin for views answering GET requests with 304 Not Modified while their validators match.
+
+    ``get_etag_parts`` returns the values the page depends on, or None to skip validation,
+    e.g. when the page does not exist. Anonymous responses may be stored by shared caches
+    for HTTP_CACHE_ANONYMOUS_MAX_AGE seconds; responses to logged-in users are private and
+    revalidated on every request.
+    """
+
+    def get_etag_parts(self):
+        return None
+
+    def get_last_modified(self):
+        return None
+
+    def get_etag(self, parts):
+        user = self.request.user
+        versions = [get_version(SITE_VERSION_KEY)]
+        if user.is_authenticated:
+            # The forms embed tokens derived from the CSRF secret, so a new secret (e.g. after
+            # logging in again) invalidates the cached page. get_token() creates a missing one.
+            get_token(self.request)
+            versions += [user.pk, get_version(user_version_key(user.pk)), self.request.META['CSRF_COOKIE']]
+        payload = repr([self.request.get_full_path(), versions, parts])
+        return quote_etag(hashlib.sha1(payload.encode()).hexdigest())
+
+    def get(self, request, *args, **kwargs):
+        parts = self.get_etag_parts()
+        etag = last_modified = None
+        if parts is not None:
+            etag = self.get_etag(parts)
+            # Last-Modified cannot express the user version, only anonymous pages send it
+            if not request.user.is_authenticated:
+                last_modified = self.get_last_modified()
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        if etag:
+            response.headers.setdefault('ETag', etag)
+        if timestamp:
+            response.headers.setdefault('Last-Modified', http_date(timestamp))
+
+        if request.user.is_authenticated:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(response, public=True, max_age=ANONYMOUS_MAX_AGE)
+        patch_vary_headers(response, ('Cookie',))
+        return response
@@ -0,0 +1,113 @@
+"""
+Database routing between the primary and its read replicas, and SQLite connection tuning.
+
+Queries go to the primary unless ReplicaRoutingMiddleware marked the current request as
+read-only, so management commands and workers never read stale data. A request stops
+using the replicas as soon as it writes, and the client keeps reading from the primary
+for DATABASE_REPLICA_PIN_SECONDS after a write so it always sees its own changes.
+"""
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICAS = getattr(settings, 'DATABASE_REPLICAS', [])
+PIN_SECONDS = getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 5)
+PIN_COOKIE = 'pin_primary'
+
+SQLITE_PRAGMAS = getattr(settings, 'SQLITE_PRAGMAS', {
+    'journal_mode': 'WAL',
+    # Safe with WAL, only the last transactions can be lost on a power failure
+    'synchronous': 'NORMAL',
+    # No busy_timeout: the wait for locks is the 'timeout' of the DATABASES OPTIONS, which the driver applies
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
+})
+
+# Whether reads of the current request may go to a replica; the default is the primary
+_use_replicas = ContextVar('use_replicas', default=False)
+# Whether the current request wrote to the primary
+_wrote = ContextVar('wrote', default=False)
+
+
+class PrimaryReplicaRouter:
+    def __init__(self, replicas=None):
+        self.replicas = REPLICAS if replicas is None else replicas
+
+    def db_for_read(self, model, **hints):
+        if self.replicas and _use_replicas.get():
+            return random.choice(self.replicas)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Read the rest of the request from the primary too
+        _use_replicas.set(False)
+        _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *self.replicas}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through replication
+        return db not in self.replicas
+
+
+class ReplicaRoutingMiddleware:
+    """Send the reads of safe requests to the replicas, unless the client wrote recently."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        tokens = self.start(request)
+        try:
+            return self.finish(self.get_response(request))
+        finally:
+            self.reset(tokens)
+
+    async def __acall__(self, request):
+        tokens = self.start(request)
+        try:
+            return self.finish(await self.get_response(request))
+        finally:
+            self.reset(tokens)
+
+    @staticmethod
+    def start(request):
+        read_only = request.method in ('GET', 'HEAD', 'OPTIONS') and PIN_COOKIE not in request.COOKIES
+        return _use_replicas.set(read_only), _wrote.set(False)
+
+    @staticmethod
+    def finish(response):
+        if _wrote.get():
+            response.set_cookie(PIN_COOKIE, '1', max_age=PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
+
+    @staticmethod
+    def reset(tokens):
+        use_replicas, wrote = tokens
+        _use_replicas.reset(use_replicas)
+        _wrote.reset(wrote)
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply SQLITE_PRAGMAS to every new SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
@@ -0,0 +1,175 @@
+"""
+Background deletion of accounts in bounded chunks.
+
+Removing an active account in one transaction would hold locks for as long as it takes
+to delete all its likes, comments, follows, notifications and posts, together with what
+other users attached to its posts. ``request_account_deletion`` only deactivates the
+account and queues an AccountDeletion; the delete_accounts worker then runs one chunk of
+at most ``batch_size`` rows per short transaction, keeping the counters of the other
+users' posts and profiles right as it goes.
+
+The steps run in order. Every chunk commits on its own and the last finished step is
+stored on the AccountDeletion row, so a worker that fails resumes where it stopped. The
+user row is deleted last, once nothing large references it anymore.
+"""
+from collections import Counter
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import conditional, models
+
+BATCH_SIZE = 500
+
+
+def request_account_deletion(user):
+    """Deactivate ``user``, which signs them out everywhere, and queue the removal of their data."""
+    with transaction.atomic():
+        models.User.objects.filter(pk=user.pk).update(is_active=False)
+        models.AccountDeletion.objects.get_or_create(user_id=user.pk)
+    user.is_active = False
+
+
+def delete_chunk(queryset, batch_size, *fields):
+    """Delete up to ``batch_size`` rows of ``queryset`` and return the ``fields`` values of the deleted rows."""
+    rows = list(queryset.order_by('pk').values_list('pk', *fields)[:batch_size])
+    if rows:
+        queryset.model.objects.filter(pk__in=[row[0] for row in rows]).delete()
+    return rows
+
+
+def decrement(queryset, key, field, ids, **updates):
+    """Subtract from ``field`` of the rows whose ``key`` is in ``ids`` the number of times each one occurs."""
+    by_delta = {}
+    for pk, count in Counter(ids).items():
+        by_delta.setdefault(count, []).append(pk)
+    # One update per distinct delta, usually just a few per chunk
+    for delta, pks in by_delta.items():
+        queryset.filter(**{f'{key}__in': pks}).update(**{field: Greatest(F(field) - delta, 0)}, **updates)
+
+
+def decrement_posts(field, post_ids):
+    # The post pages show the counters, their updated_at validates them
+    decrement(models.Post.objects.all(), 'pk', field, post_ids, updated_at=timezone.now())
+
+
+def decrement_profiles(field, user_ids):
+    decrement(models.UserProfile.objects.all(), 'user_id', field, user_ids)
+    if user_ids:
+        transaction.on_commit(partial(conditional.bump_user_versions, *set(user_ids)))
+
+
+def delete_notification_events(user_id, batch_size):
+    events = models.NotificationEvent.objects.filter(Q(recipient_user_id=user_id) | Q(action_user_id=user_id))
+    return len(delete_chunk(events, batch_size))
+
+
+def delete_notifications(user_id, batch_size):
+    rows = delete_chunk(models.Notification.objects.filter(recipient_user_id=user_id), batch_size)
+    if not rows:
+        # Notifications coalesced under the user's name go too, the other actors were not recorded
+        sent = models.Notification.objects.filter(action_user_id=user_id)
+        rows = delete_chunk(sent, batch_size, 'recipient_user_id', 'is_read')
+        decrement_profiles('unread_notifications_count', [recipient for pk, recipient, is_read in rows if not is_read])
+    return len(rows)
+
+
+def delete_follows(user_id, batch_size):
+    rows = delete_chunk(models.Follow.objects.filter(follower_id=user_id), batch_size, 'following_id')
+    decrement_profiles('followers_count', [following for pk, following in rows])
+    if not rows:
+        rows = delete_chunk(models.Follow.objects.filter(following_id=user_id), batch_size, 'follower_id')
+        decrement_profiles('following_count', [follower for pk, follower in rows])
+        # The timeline entries of the user's posts go with the post_children step
+    return len(rows)
+
+
+def delete_likes(user_id, batch_size):
+    rows = delete_chunk(models.PostLike.objects.filter(user_id=user_id), batch_size, 'post_id')
+    decrement_posts('like_count', [post_id for pk, post_id in rows])
+    if not rows:
+        comment_likes = models.Comment.likes.through.objects.filter(user_id=user_id)
+        rows = delete_chunk(comment_likes, batch_size, 'comment__post_id')
+        models.Post.objects.filter(pk__in={post_id for pk, post_id in rows}).update(updated_at=timezone.now())
+    return len(rows)
+
+
+def delete_comments(user_id, batch_size):
+    rows = delete_chunk(models.Comment.objects.filter(user_id=user_id), batch_size, 'post_id')
+    decrement_posts('comment_count', [post_id for pk, post_id in rows])
+    return len(rows)
+
+
+def delete_timeline(user_id, batch_size):
+    return len(delete_chunk(models.TimelineEntry.objects.filter(user_id=user_id), batch_size))
+
+
+def delete_post_children(user_id, batch_size):
+    # What other users attached to the posts, so deleting a post cascades to a handful of rows
+    for queryset in (
+        models.PostLike.objects.filter(post__user_id=user_id),
+        models.Comment.objects.filter(post__user_id=user_id),
+        models.TimelineEntry.objects.filter(post__user_id=user_id),
+    ):
+        rows = delete_chunk(queryset, batch_size)
+        if rows:
+            return len(rows)
+    return 0
+
+
+def delete_posts(user_id, batch_size):
+    rows = delete_chunk(models.Post.objects.filter(user_id=user_id), batch_size, 'image')
+    # Released once the rows are gone, files shared with other posts stay
+    storage = models.Post.image.field.storage
+    for pk, image in rows:
+        if image:
+            transaction.on_commit(partial(storage.delete, image))
+    return len(rows)
+
+
+def delete_account(user_id, batch_size):
+    profile = models.UserProfile.objects.filter(user_id=user_id).first()
+    deleted, rows = models.User.objects.filter(pk=user_id).delete()
+    if profile and profile.avatar:
+        transaction.on_commit(partial(profile.avatar.storage.delete, profile.avatar.name))
+    return deleted
+
+
+# name: function deleting one chunk of the user's rows and returning how many went, 0 once done
+STEPS = {
+    'notification_events': delete_notification_events,
+    'notifications': delete_notifications,
+    'follows': delete_follows,
+    'likes': delete_likes,
+    'comments': delete_comments,
+    'timeline': delete_timeline,
+    'post_children': delete_post_children,
+    'posts': delete_posts,
+    'account': delete_account,
+}
+
+
+def process(batch_size=BATCH_SIZE):
+    """
+    Delete one chunk of the oldest queued account, or finish its current step.
+
+    Returns the number of rows deleted, or None when no deletion is queued.
+    """
+    with transaction.atomic():
+        job = models.AccountDeletion.objects.select_for_update().order_by('requested_at').first()
+        if job is None:
+            return None
+
+        names = list(STEPS)
+        name = names[names.index(job.step) + 1] if job.step else names[0]
+        deleted = STEPS[name](job.user_id, batch_size)
+        if name == 'account':
+            # The job row went with the user
+            return deleted
+        if not deleted:
+            job.step = name
+            job.save(update_fields=['step', 'updated_at'])
+    return deleted
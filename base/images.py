@@ -0,0 +1,124 @@
+"""
+Resized derivatives of uploaded post images and avatars.
+
+Derivatives are generated by a small worker pool once the upload is committed, stored
+next to each other under ``derivatives/<original name>/`` in a compressed format, and
+recorded on the model so templates can pick the smallest file that fits.
+"""
+import io
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import conditional
+
+logger = logging.getLogger(__name__)
+
+# name: (width, height, crop)
+POST_IMAGE_SIZES = {
+    'grid': (600, 600, True),
+    'feed': (1080, 1350, False),
+    'full': (2048, 2048, False),
+}
+AVATAR_SIZES = {
+    'small': (64, 64, True),
+    'medium': (400, 400, True),
+}
+
+FORMAT = getattr(settings, 'IMAGE_DERIVATIVE_FORMAT', 'WEBP')
+QUALITY = getattr(settings, 'IMAGE_DERIVATIVE_QUALITY', 80)
+WORKERS = getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='image-derivatives')
+    return _executor
+
+
+def derivative_dir(source_name):
+    stem = posixpath.splitext(source_name)[0]
+    return f'derivatives/{stem}'
+
+
+def derivative_name(source_name, size):
+    return f'{derivative_dir(source_name)}/{size}.{FORMAT.lower()}'
+
+
+def render_derivative(image, width, height, crop):
+    if crop:
+        resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+    else:
+        resized = image.copy()
+        resized.thumbnail((width, height), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    resized.save(buffer, FORMAT, quality=QUALITY, method=4)
+    return resized.size, buffer.getvalue()
+
+
+def generate_derivatives(field_file, sizes):
+    """Render every size of ``field_file`` and return the mapping stored on the model."""
+    storage = field_file.storage
+    with field_file.open('rb'):
+        image = ImageOps.exif_transpose(Image.open(field_file))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    variants = {}
+    for size, (width, height, crop) in sizes.items():
+        (actual_width, actual_height), data = render_derivative(image, width, height, crop)
+        name = derivative_name(field_file.name, size)
+        if storage.exists(name):
+            storage.delete(name)
+        name = storage.save(name, ContentFile(data))
+        variants[size] = {'name': name, 'width': actual_width, 'height': actual_height}
+    return variants
+
+
+def generate_post_derivatives(post_id):
+    from .models import Post
+
+    post = Post.objects.filter(pk=post_id).only('id', 'image').first()
+    if post is None or not post.image:
+        return
+    variants = generate_derivatives(post.image, POST_IMAGE_SIZES)
+    # Skip the write if the image was replaced in the meantime. Bumping updated_at
+    # invalidates the cached post cards and the ETags of the pages still pointing at the
+    # original image.
+    Post.objects.filter(pk=post_id, image=post.image.name).update(image_variants=variants, updated_at=timezone.now())
+
+
+def generate_avatar_derivatives(profile_id):
+    from .models import UserProfile
+
+    profile = UserProfile.objects.filter(pk=profile_id).only('id', 'avatar').first()
+    if profile is None or not profile.avatar:
+        return
+    variants = generate_derivatives(profile.avatar, AVATAR_SIZES)
+    if UserProfile.objects.filter(pk=profile_id, avatar=profile.avatar.name).update(avatar_variants=variants):
+        conditional.bump_site_version()
+
+
+def _run(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Generating image derivatives with %s%r failed', func.__name__, args)
+    finally:
+        connections.close_all()
+
+
+def schedule(func, *args):
+    """Run a derivative job on the worker pool, off the request path."""
+    get_executor().submit(_run, func, *args)
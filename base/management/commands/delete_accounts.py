@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from base import deletion
+from base.models import User
+
+
+class Command(BaseCommand):
+    help = 'Delete the accounts queued for deletion, in chunks of short transactions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Queue these accounts for deletion first.')
+        parser.add_argument(
+            '--batch-size', type=int, default=deletion.BATCH_SIZE, help='Number of rows deleted per transaction.'
+        )
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep while the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit.')
+
+    def handle(self, *args, **options):
+        for username in options['usernames']:
+            user = User.objects.filter(username=username).first()
+            if user is None:
+                raise CommandError(f'User "{username}" does not exist.')
+            deletion.request_account_deletion(user)
+
+        total = 0
+        while True:
+            deleted = deletion.process(options['batch_size'])
+            if deleted is not None:
+                total += deleted
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {total} rows of queued accounts.'))
@@ -0,0 +1,65 @@
+import posixpath
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from base import images, storage
+from base.models import Post, UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Remove uploaded images and their derivatives that no post or profile references anymore.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Seconds since the last change under which files are kept, their upload may not be committed yet.',
+        )
+        parser.add_argument(
+            '--legacy', action='store_true',
+            help='Also collect the files uploaded before content-addressed storage, at the top of MEDIA_ROOT.',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only report the files that would be removed.')
+
+    def handle(self, *args, **options):
+        referenced = set()
+        for names in (
+            Post.objects.exclude(image='').values_list('image', flat=True),
+            UserProfile.objects.exclude(avatar='').values_list('avatar', flat=True),
+        ):
+            referenced.update(names.order_by().iterator(chunk_size=2000))
+        sources = {images.derivative_dir(name) for name in referenced}
+        cutoff = timezone.now() - timedelta(seconds=options['min_age'])
+
+        count = 0
+        for name in self.candidates(options['legacy']):
+            if name.startswith(storage.DERIVATIVES_PREFIX):
+                if posixpath.dirname(name) in sources:
+                    continue
+            elif name in referenced or name == posixpath.basename(UserProfile.get_default_avatar()):
+                continue
+            if default_storage.get_modified_time(name) > cutoff:
+                continue
+
+            if options['dry_run']:
+                self.stdout.write(name)
+            elif name.startswith(storage.DERIVATIVES_PREFIX):
+                default_storage.delete(name)
+            elif not default_storage.purge(name):
+                # Referenced by an upload committed meanwhile
+                continue
+            count += 1
+
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {count} unreferenced files.'))
+
+    def candidates(self, legacy):
+        """Stream the names of the stored uploads and derivatives, directory by directory."""
+        for prefix in (storage.CAS_PREFIX, storage.DERIVATIVES_PREFIX):
+            if default_storage.exists(prefix):
+                yield from default_storage.walk(prefix.rstrip('/'))
+        if legacy:
+            directories, files = default_storage.listdir('')
+            yield from files
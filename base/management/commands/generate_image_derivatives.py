@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from base import images
+from base.models import Post, UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Generate the resized derivatives of post images and avatars uploaded before they existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate derivatives that already exist too.')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').order_by()
+        profiles = UserProfile.objects.exclude(avatar='').order_by()
+        if not options['all']:
+            posts = posts.filter(image_variants={})
+            profiles = profiles.filter(avatar_variants={})
+
+        count = 0
+        for post_id in posts.values_list('pk', flat=True).iterator():
+            count += self.generate(images.generate_post_derivatives, post_id)
+        for profile_id in profiles.values_list('pk', flat=True).iterator():
+            count += self.generate(images.generate_avatar_derivatives, profile_id)
+        self.stdout.write(self.style.SUCCESS(f'Generated derivatives for {count} images.'))
+
+    def generate(self, func, pk):
+        try:
+            func(pk)
+        except (OSError, ValueError) as e:
+            self.stderr.write(f'Skipping {pk}: {e}')
+            return 0
+        return 1
@@ -0,0 +1,157 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from base.models import User, Post, Hashtag
+
+# name: relative weight in the request mix
+SCENARIOS = {
+    'feed': 25,
+    'followed_feed': 15,
+    'profile': 15,
+    'post_detail': 15,
+    'like_toggle': 8,
+    'follow_toggle': 4,
+    'search': 10,
+    'notifications': 8,
+}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a realistic mix of requests against the URLconf with concurrent logged-in clients '
+        'and report latency percentiles and throughput per endpoint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Number of concurrent clients.')
+        parser.add_argument('--requests', type=int, default=1000, help='Total number of requests to send.')
+        parser.add_argument('--duration', type=float, default=None,
+                            help='Stop after this many seconds instead of after --requests requests.')
+        parser.add_argument('--users', type=int, default=200, help='Number of distinct users the clients log in as.')
+        parser.add_argument('--sample-size', type=int, default=1000,
+                            help='Number of posts and hashtags sampled as request targets.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the request mix.')
+        parser.add_argument('--host', default='localhost', help='Host header sent with every request.')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.host = options['host']
+        self.users = list(User.objects.order_by('?').values_list('username', flat=True)[:options['users']])
+        self.posts = [str(pk) for pk in Post.objects.order_by('?').values_list('id', flat=True)[:options['sample_size']]]
+        self.hashtags = list(Hashtag.objects.order_by('?').values_list('name', flat=True)[:options['sample_size']])
+        if not self.users or not self.posts:
+            raise CommandError('There are no users or posts to request, run seed_data first.')
+        connections.close_all()
+
+        self.results = {name: [] for name in SCENARIOS}
+        self.errors = {name: 0 for name in SCENARIOS}
+        self.lock = threading.Lock()
+        self.remaining = options['requests']
+        self.deadline = time.perf_counter() + options['duration'] if options['duration'] else None
+
+        workers = [
+            threading.Thread(target=self.worker, args=(self.random.getrandbits(32),))
+            for _ in range(options['concurrency'])
+        ]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.report(time.perf_counter() - started)
+
+    def next_request(self):
+        with self.lock:
+            if self.deadline is not None:
+                return time.perf_counter() < self.deadline
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def worker(self, seed):
+        rng = random.Random(seed)
+        client = Client(HTTP_HOST=self.host)
+        user = User.objects.get(username=rng.choice(self.users))
+        client.force_login(user)
+        names = list(SCENARIOS)
+        weights = list(SCENARIOS.values())
+
+        try:
+            while self.next_request():
+                name = rng.choices(names, weights)[0]
+                method, url, data = getattr(self, f'request_{name}')(rng, user)
+                started = time.perf_counter()
+                try:
+                    response = getattr(client, method)(url, data)
+                    failed = response.status_code >= 400
+                except Exception:
+                    failed = True
+                elapsed = time.perf_counter() - started
+                with self.lock:
+                    self.results[name].append(elapsed)
+                    if failed:
+                        self.errors[name] += 1
+        finally:
+            connections.close_all()
+
+    def request_feed(self, rng, user):
+        return 'get', reverse('index'), {}
+
+    def request_followed_feed(self, rng, user):
+        return 'get', reverse('posts_followed'), {}
+
+    def request_profile(self, rng, user):
+        return 'get', reverse('post_user_grid', args=[rng.choice(self.users)]), {}
+
+    def request_post_detail(self, rng, user):
+        return 'get', reverse('post_details', args=[rng.choice(self.posts)]), {}
+
+    def request_like_toggle(self, rng, user):
+        return 'post', reverse('index'), {'post_like_id': rng.choice(self.posts)}
+
+    def request_follow_toggle(self, rng, user):
+        username = rng.choice(self.users)
+        if username == user.username:
+            return self.request_profile(rng, user)
+        return 'post', reverse('post_user_grid', args=[username]), {}
+
+    def request_search(self, rng, user):
+        if self.hashtags and rng.random() < 0.5:
+            return 'get', reverse('search'), {'text': rng.choice(self.hashtags)[:3], 'choice': 'hashtag'}
+        return 'get', reverse('search'), {'text': rng.choice(self.users)[:4], 'choice': 'user'}
+
+    def request_notifications(self, rng, user):
+        return 'get', reverse('notifications'), {}
+
+    def report(self, elapsed):
+        self.stdout.write(
+            f'{"endpoint":<16}{"requests":>10}{"errors":>8}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+        )
+        total = 0
+        for name, latencies in self.results.items():
+            if not latencies:
+                continue
+            latencies.sort()
+            total += len(latencies)
+            self.stdout.write(
+                f'{name:<16}{len(latencies):>10}{self.errors[name]:>8}{len(latencies) / elapsed:>10.1f}'
+                f'{percentile(latencies, 0.50) * 1000:>10.1f}'
+                f'{percentile(latencies, 0.95) * 1000:>10.1f}'
+                f'{percentile(latencies, 0.99) * 1000:>10.1f}'
+            )
+        self.stdout.write(self.style.SUCCESS(f'{total} requests in {elapsed:.1f}s, {total / elapsed:.1f} req/s'))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from base import notifications
+
+
+class Command(BaseCommand):
+    help = 'Drain the notification event queue, coalescing events into notifications.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of events processed per transaction.')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep while the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit.')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = notifications.process_events(options['batch_size'])
+            total += processed
+            if processed:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Processed {total} notification events.'))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from base import search
+from base.models import User, Hashtag
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the user and hashtag search index, or only refresh its popularity ranking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--popularity-only', action='store_true',
+                            help='Only refresh the follower and post counts used for ranking.')
+
+    def handle(self, *args, **options):
+        if not options['popularity_only']:
+            users = User.objects.select_related('userprofile').order_by('pk')
+            count = self.index_in_batches(users, search.index_users)
+            self.stdout.write(f'Indexed {count} users.')
+
+            hashtags = Hashtag.objects.order_by('pk')
+            count = self.index_in_batches(hashtags, search.index_hashtags)
+            self.stdout.write(f'Indexed {count} hashtags.')
+
+        search.refresh_popularity()
+        self.stdout.write(self.style.SUCCESS('Search index is up to date.'))
+
+    @staticmethod
+    def index_in_batches(queryset, index):
+        count = 0
+        batch = []
+        for obj in queryset.iterator(chunk_size=search.BATCH_SIZE):
+            batch.append(obj)
+            if len(batch) == search.BATCH_SIZE:
+                index(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            index(batch)
+            count += len(batch)
+        return count
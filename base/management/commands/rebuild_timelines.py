@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from base import timeline
+from base.models import Follow, TimelineEntry
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized followed-posts timelines from the existing follows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', help='Delete all timeline entries first.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            TimelineEntry.objects.all().delete()
+
+        follows = Follow.objects.order_by('pk').values_list('follower_id', 'following_id')
+        count = 0
+        for follower_id, following_id in follows.iterator(chunk_size=timeline.BATCH_SIZE):
+            timeline.backfill(follower_id, following_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Backfilled timelines for {count} follows.'))
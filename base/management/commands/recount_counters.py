@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from base.models import Post, Comment, Follow, Notification, UserProfile
+
+
+def count_subquery(queryset, field, outer_field='pk'):
+    """Correlated COUNT(*) of ``queryset`` rows whose ``field`` points at the outer row."""
+    queryset = queryset.filter(**{field: OuterRef(outer_field)}).order_by().values(field)
+    return Coalesce(Subquery(queryset.annotate(count=Count('*')).values('count')), 0)
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized counters in batches to repair any drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows updated per transaction.')
+
+    def handle(self, *args, **options):
+        fixed = self.recount(
+            Post.objects.annotate(
+                actual_like_count=count_subquery(Post.likes.through.objects, 'post'),
+                actual_comment_count=count_subquery(Comment.objects, 'post'),
+            ),
+            ['like_count', 'comment_count'],
+            options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Fixed counters on {fixed} posts.'))
+
+        fixed = self.recount(
+            UserProfile.objects.annotate(
+                actual_posts_count=count_subquery(Post.objects, 'user', 'user'),
+                actual_followers_count=count_subquery(Follow.objects, 'following', 'user'),
+                actual_following_count=count_subquery(Follow.objects, 'follower', 'user'),
+                actual_unread_notifications_count=count_subquery(
+                    Notification.objects.filter(is_read=False), 'recipient_user', 'user'
+                ),
+            ),
+            ['posts_count', 'followers_count', 'following_count', 'unread_notifications_count'],
+            options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Fixed counters on {fixed} profiles.'))
+
+    def recount(self, queryset, fields, batch_size):
+        """
+        Walk ``queryset`` in primary key order and copy every ``actual_<field>`` annotation
+        onto its stored ``<field>`` column where the two differ.
+        """
+        model = queryset.model
+        queryset = queryset.only('pk', *fields).order_by('pk')
+        fixed = 0
+        last_pk = None
+
+        while True:
+            batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+
+            changed = []
+            for obj in batch:
+                stale = False
+                for field in fields:
+                    actual = getattr(obj, f'actual_{field}')
+                    if getattr(obj, field) != actual:
+                        setattr(obj, field, actual)
+                        stale = True
+                if stale:
+                    changed.append(obj)
+
+            if changed:
+                with transaction.atomic():
+                    model.objects.bulk_update(changed, fields)
+            fixed += len(changed)
+            last_pk = batch[-1].pk
+
+        return fixed
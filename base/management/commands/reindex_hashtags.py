@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from base.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the post/hashtag associations from the post descriptions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of posts loaded and reindexed at once.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        posts = Post.objects.order_by().only('id', 'description', 'created_at')
+
+        count = 0
+        batch = []
+        for post in posts.iterator(chunk_size=batch_size):
+            batch.append(post)
+            if len(batch) == batch_size:
+                count += self.reindex(batch)
+                batch = []
+        if batch:
+            count += self.reindex(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Reindexed hashtags of {count} posts.'))
+
+    @staticmethod
+    def reindex(posts):
+        Post.associate_hashtags(posts)
+        return len(posts)
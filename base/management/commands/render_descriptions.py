@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from base.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Render the stored HTML of post descriptions written before it existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of posts rendered per transaction.')
+        parser.add_argument('--all', action='store_true',
+                            help='Render every description again, e.g. after the hashtag URLs changed.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        posts = Post.objects.exclude(description='').order_by('pk').only('id', 'description', 'description_html')
+        if not options['all']:
+            posts = posts.filter(description_html='')
+
+        count = 0
+        last_pk = None
+        while True:
+            batch = posts if last_pk is None else posts.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+
+            changed = []
+            for post in batch:
+                html = Post.render_description(post.description)
+                if html != post.description_html:
+                    post.description_html = html
+                    changed.append(post)
+            if changed:
+                with transaction.atomic():
+                    Post.objects.bulk_update(changed, ['description_html'])
+            count += len(changed)
+            last_pk = batch[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f'Rendered descriptions of {count} posts.'))
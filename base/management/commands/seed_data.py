@@ -0,0 +1,256 @@
+import contextlib
+import itertools
+import random
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from base.models import User, UserProfile, Hashtag, Post, PostHashtag, PostLike, Follow, Comment, Notification
+
+WORDS = (
+    'sunset', 'coffee', 'street', 'mountain', 'beach', 'city', 'forest', 'portrait', 'night', 'morning',
+    'travel', 'food', 'friends', 'summer', 'winter', 'river', 'sky', 'light', 'dog', 'cat',
+)
+# Models whose dates are spread over the seeded window
+DATED_MODELS = (Post, PostLike, Follow, Comment, Notification)
+
+
+@contextlib.contextmanager
+def explicit_dates():
+    """Let bulk_create keep the dates set on the objects instead of stamping them with the current time."""
+    fields = [
+        field for model in DATED_MODELS for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    flags = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in flags:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with synthetic users, posts, follows, likes, comments, hashtags and notifications '
+        'for local load testing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of users to create.')
+        parser.add_argument('--posts-per-user', type=float, default=5, help='Average number of posts per user.')
+        parser.add_argument('--follows-per-user', type=float, default=20, help='Average number of follows per user.')
+        parser.add_argument('--likes-per-post', type=float, default=10, help='Average number of likes per post.')
+        parser.add_argument('--comments-per-post', type=float, default=2, help='Average number of comments per post.')
+        parser.add_argument('--notifications-per-user', type=float, default=10,
+                            help='Average number of notifications per user.')
+        parser.add_argument('--hashtags', type=int, default=500, help='Size of the hashtag vocabulary.')
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Zipf exponent of the user popularity, which drives follows and likes, '
+                                 'and of the hashtag popularity.')
+        parser.add_argument('--days', type=float, default=90,
+                            help='Length of the window, ending now, over which the creation dates are spread.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed generates the same data.')
+        parser.add_argument('--prefix', default='seed', help='Prefix of the generated usernames.')
+        parser.add_argument('--password', default='password', help='Password of every generated user.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of rows inserted per query.')
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='Do not recount counters or rebuild timelines, search index and trends.')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.start = self.now - timedelta(days=options['days'])
+
+        user_ids = self.create_users(options['users'], options['prefix'], options['password'])
+        # The first users are the most popular ones: weights follow a Zipf distribution over the rank
+        popularity = [1 / rank ** options['skew'] for rank in range(1, len(user_ids) + 1)]
+        user_weights = list(itertools.accumulate(popularity))
+        # Posts of popular authors get more likes, scaled so the average stays --likes-per-post
+        mean_popularity = sum(popularity) / len(popularity) if popularity else 1
+        like_factors = {user_id: weight / mean_popularity for user_id, weight in zip(user_ids, popularity)}
+        hashtag_ids = self.create_hashtags(options['hashtags'])
+        hashtag_weights = list(itertools.accumulate(
+            1 / rank ** options['skew'] for rank in range(1, len(hashtag_ids) + 1)
+        ))
+
+        with explicit_dates():
+            posts = self.create_posts(user_ids, options['posts_per_user'], hashtag_ids, hashtag_weights)
+            self.create_follows(user_ids, user_weights, options['follows_per_user'])
+            self.create_likes(posts, user_ids, user_weights, like_factors, options['likes_per_post'])
+            self.create_comments(posts, user_ids, options['comments_per_post'])
+            self.create_notifications(user_ids, posts, options['notifications_per_user'])
+
+        if not options['skip_derived']:
+            for command, kwargs in [
+                ('recount_counters', {}),
+                ('render_descriptions', {}),
+                ('rebuild_timelines', {}),
+                ('rebuild_search_index', {}),
+                ('update_trending_hashtags', {'full': True}),
+            ]:
+                self.stdout.write(f'Running {command}...')
+                call_command(command, stdout=self.stdout, **kwargs)
+
+        self.stdout.write(self.style.SUCCESS('Seeding finished.'))
+
+    def count(self, mean):
+        """Random non-negative number of items averaging ``mean``, with a long tail."""
+        if mean <= 0:
+            return 0
+        return int(self.random.expovariate(1 / mean))
+
+    def date(self, after=None):
+        """Random date between ``after``, or the start of the seeded window, and now."""
+        start = after or self.start
+        return start + (self.now - start) * self.random.random()
+
+    def bulk_insert(self, model, objects, ignore_conflicts=False):
+        """Insert the ``objects`` iterable in batches, one transaction per batch. Returns the number of rows."""
+        objects = iter(objects)
+        total = 0
+        while True:
+            batch = list(itertools.islice(objects, self.batch_size))
+            if not batch:
+                break
+            with transaction.atomic():
+                model.objects.bulk_create(batch, ignore_conflicts=ignore_conflicts)
+            total += len(batch)
+        self.stdout.write(f'Created {total} {model._meta.verbose_name_plural}.')
+        return total
+
+    def create_users(self, count, prefix, password):
+        start = User.objects.filter(username__startswith=prefix).count()
+        # Hashing once keeps seeding fast, every generated user shares the same password
+        password = make_password(password)
+        names = [f'{prefix}{i}' for i in range(start, start + count)]
+        self.bulk_insert(User, (
+            User(
+                username=name,
+                email=f'{name}@example.com',
+                password=password,
+                first_name=self.random.choice(WORDS).title(),
+                last_name=self.random.choice(WORDS).title(),
+            )
+            for name in names
+        ))
+        # Not every backend returns primary keys from bulk_create
+        user_ids = []
+        for i in range(0, len(names), self.batch_size):
+            chunk = names[i:i + self.batch_size]
+            ids = dict(User.objects.filter(username__in=chunk).values_list('username', 'id'))
+            user_ids.extend(ids[name] for name in chunk)
+
+        # bulk_create skips User.save, which creates the profile
+        self.bulk_insert(UserProfile, (UserProfile(user_id=user_id) for user_id in user_ids))
+        return user_ids
+
+    def create_hashtags(self, count):
+        names = [f'{self.random.choice(WORDS)}{i}' for i in range(count)]
+        self.bulk_insert(Hashtag, (Hashtag(name=name) for name in names), ignore_conflicts=True)
+        ids = dict(Hashtag.objects.filter(name__in=names).values_list('name', 'id'))
+        return [ids[name] for name in names]
+
+    def create_posts(self, user_ids, mean, hashtag_ids, hashtag_weights):
+        """Create the posts and their hashtags. Returns ``(post_id, author_id, created_at)`` tuples."""
+        posts = []
+        post_hashtags = []
+        for user_id in user_ids:
+            for _ in range(self.count(mean)):
+                tags = set(self.random.choices(hashtag_ids, cum_weights=hashtag_weights, k=self.random.randint(0, 3)))
+                posts.append((uuid.UUID(int=self.random.getrandbits(128), version=4), user_id, self.date()))
+                post_hashtags.append(tags)
+        hashtag_names = dict(Hashtag.objects.filter(id__in=hashtag_ids).values_list('id', 'name'))
+
+        self.bulk_insert(Post, (
+            Post(
+                id=post_id,
+                user_id=user_id,
+                image='seed/placeholder.jpg',
+                description=' '.join(
+                    [self.random.choice(WORDS) for _ in range(self.random.randint(1, 8))]
+                    + [f'#{hashtag_names[tag]}' for tag in tags]
+                ),
+                created_at=created_at,
+                updated_at=created_at,
+            )
+            for (post_id, user_id, created_at), tags in zip(posts, post_hashtags)
+        ))
+        self.bulk_insert(PostHashtag, (
+            PostHashtag(post_id=post_id, hashtag_id=tag, created_at=created_at)
+            for (post_id, user_id, created_at), tags in zip(posts, post_hashtags)
+            for tag in tags
+        ))
+        return posts
+
+    def create_follows(self, user_ids, user_weights, mean):
+        def follows():
+            for follower_id in user_ids:
+                following = set(self.random.choices(user_ids, cum_weights=user_weights, k=self.count(mean)))
+                following.discard(follower_id)
+                for following_id in following:
+                    yield Follow(follower_id=follower_id, following_id=following_id, created_at=self.date())
+
+        self.bulk_insert(Follow, follows(), ignore_conflicts=True)
+
+    def create_likes(self, posts, user_ids, user_weights, like_factors, mean):
+        def likes():
+            for post_id, author_id, created_at in posts:
+                # Likers are drawn with the same skew as the followed users
+                count = self.count(mean * like_factors[author_id])
+                likers = set(self.random.choices(user_ids, cum_weights=user_weights, k=count))
+                for user_id in likers:
+                    yield PostLike(post_id=post_id, user_id=user_id, created_at=self.date(created_at))
+
+        self.bulk_insert(PostLike, likes(), ignore_conflicts=True)
+
+    def create_comments(self, posts, user_ids, mean):
+        def comments():
+            for post_id, author_id, created_at in posts:
+                for _ in range(self.count(mean)):
+                    commented_at = self.date(created_at)
+                    yield Comment(
+                        post_id=post_id,
+                        user_id=self.random.choice(user_ids),
+                        text=' '.join(self.random.sample(WORDS, 5)),
+                        created_at=commented_at,
+                        updated_at=commented_at,
+                    )
+
+        self.bulk_insert(Comment, comments())
+
+    def create_notifications(self, user_ids, posts, mean):
+        posts_by_author = {}
+        for post_id, author_id, created_at in posts:
+            posts_by_author.setdefault(author_id, []).append((post_id, created_at))
+
+        def notifications():
+            for recipient_id in user_ids:
+                own_posts = posts_by_author.get(recipient_id)
+                for _ in range(self.count(mean)):
+                    verb = self.random.choice([choice for choice, label in Notification.VERB_CHOICES])
+                    post_id = created_at = None
+                    if verb != Notification.FOLLOW:
+                        if not own_posts:
+                            verb = Notification.FOLLOW
+                        else:
+                            post_id, created_at = self.random.choice(own_posts)
+                    yield Notification(
+                        verb=verb,
+                        recipient_user_id=recipient_id,
+                        action_user_id=self.random.choice(user_ids),
+                        action_post_id=post_id,
+                        message=Notification.MESSAGES[verb],
+                        is_read=self.random.random() < 0.7,
+                        timestamp=self.date(created_at),
+                    )
+
+        self.bulk_insert(Notification, notifications())
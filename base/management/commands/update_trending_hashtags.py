@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from base import trending
+
+
+class Command(BaseCommand):
+    help = 'Fold the hashtags added since the last run into the trending hashtags. Run it periodically.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute the trends from all posts.')
+
+    def handle(self, *args, **options):
+        count = trending.update(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Added {count} tagged posts to the trending hashtags.'))
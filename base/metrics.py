@@ -0,0 +1,222 @@
+"""
+In-process request metrics.
+
+MetricsMiddleware records, per resolved URL name, histograms of the request latency,
+the number of SQL queries and the time spent in them, the template render time and the
+response size. The registry lives in the worker process memory and is exposed in the
+Prometheus text format by MetricsView to staff users and to scrapers sending the
+METRICS_TOKEN bearer token; every worker process reports its own numbers.
+
+The SQL queries are counted by an execute wrapper installed on every database connection
+when it is opened, which adds them to the stats of the request in the current context.
+Under ASGI the queries of sync views run in a worker thread with their own connections,
+the context is copied there by sync_to_async.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name: (help, buckets)
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('Time spent handling the request.', LATENCY_BUCKETS),
+    'http_request_sql_queries': ('Number of SQL queries executed by the request.', QUERY_COUNT_BUCKETS),
+    'http_request_sql_duration_seconds': ('Time spent executing SQL queries.', LATENCY_BUCKETS),
+    'http_request_template_duration_seconds': ('Time spent rendering the template response.', LATENCY_BUCKETS),
+    'http_response_size_bytes': ('Size of the response body.', SIZE_BUCKETS),
+}
+
+SERVER_TIMING = getattr(settings, 'METRICS_SERVER_TIMING', settings.DEBUG)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One slot per bucket and the last one for +Inf, cumulated when exported
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.requests = {}
+
+    def record(self, view, method, status, observations):
+        with self.lock:
+            key = (view, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for name, value in observations:
+                histogram = self.histograms.get((name, view))
+                if histogram is None:
+                    histogram = self.histograms[(name, view)] = Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+            self.requests.clear()
+
+    def export(self):
+        """Render every metric in the Prometheus text exposition format."""
+        lines = [
+            '# HELP http_requests_total Number of handled requests.',
+            '# TYPE http_requests_total counter',
+        ]
+        with self.lock:
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f'http_requests_total{{view="{escape(view)}",method="{method}",status="{status}"}} {count}'
+                )
+
+            for name, (help_text, buckets) in HISTOGRAMS.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, view), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    label = f'view="{escape(view)}"'
+                    cumulative = 0
+                    for bound, count in zip(buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{{label},le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{label}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{label}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def is_authorized(request):
+    """Whether ``request`` comes from a staff user or carries ``Authorization: Bearer <METRICS_TOKEN>``."""
+    if request.user.is_staff:
+        return True
+    # Not the client address: behind a local reverse proxy every request comes from 127.0.0.1
+    expected = getattr(settings, 'METRICS_TOKEN', '')
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return bool(expected) and scheme.lower() == 'bearer' and constant_time_compare(token, expected)
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+# RequestStats of the request being handled in this context
+current_stats = ContextVar('current_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'sql_time', 'template_started', 'template_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0
+        self.template_started = None
+        self.template_time = 0
+
+    def template_rendered(self, response):
+        self.template_time += time.perf_counter() - self.template_started
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.sql_time += time.perf_counter() - started
+        stats.queries += 1
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver adding ``record_query`` to the execute wrappers of ``connection``."""
+    # Called again when a closed connection reconnects
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class MetricsMiddleware:
+    """Record the metrics of every request. Place it first in MIDDLEWARE to time the whole stack."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats, started = self.start(request)
+        token = current_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats, started = self.start(request)
+        token = current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.finish(request, response, stats, started)
+
+    @staticmethod
+    def start(request):
+        stats = request._metrics = RequestStats()
+        return stats, time.perf_counter()
+
+    @staticmethod
+    def finish(request, response, stats, started):
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        observations = [
+            ('http_request_duration_seconds', duration),
+            ('http_request_sql_queries', stats.queries),
+            ('http_request_sql_duration_seconds', stats.sql_time),
+        ]
+        if stats.template_started is not None:
+            observations.append(('http_request_template_duration_seconds', stats.template_time))
+        if not response.streaming:
+            observations.append(('http_response_size_bytes', len(response.content)))
+        registry.record(view, request.method, response.status_code, observations)
+
+        if SERVER_TIMING:
+            response['Server-Timing'] = ', '.join([
+                f'sql;desc="{stats.queries} queries";dur={stats.sql_time * 1000:.2f}',
+                f'template;dur={stats.template_time * 1000:.2f}',
+                f'total;dur={duration * 1000:.2f}',
+            ])
+        return response
+
+    def process_template_response(self, request, response):
+        stats = request._metrics
+        stats.template_started = time.perf_counter()
+        response.add_post_render_callback(stats.template_rendered)
+        return response
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:45
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Post = apps.get_model('base', 'Post')
+    Comment = apps.get_model('base', 'Comment')
+
+    likes = Post.likes.through.objects.filter(post=OuterRef('pk')).order_by().values('post')
+    comments = Comment.objects.filter(post=OuterRef('pk')).order_by().values('post')
+    Post.objects.update(
+        like_count=Coalesce(Subquery(likes.annotate(count=Count('*')).values('count')), 0),
+        comment_count=Coalesce(Subquery(comments.annotate(count=Count('*')).values('count')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0008_alter_notification_action_comment_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
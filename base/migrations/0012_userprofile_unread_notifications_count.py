@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:49
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_unread_notifications_count(apps, schema_editor):
+    UserProfile = apps.get_model('base', 'UserProfile')
+    Notification = apps.get_model('base', 'Notification')
+
+    unread = Notification.objects.filter(recipient_user=OuterRef('user'), is_read=False).order_by().values('recipient_user')
+    UserProfile.objects.update(
+        unread_notifications_count=Coalesce(Subquery(unread.annotate(count=Count('*')).values('count')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0011_post_image_variants_userprofile_avatar_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='unread_notifications_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_unread_notifications_count, migrations.RunPython.noop),
+    ]
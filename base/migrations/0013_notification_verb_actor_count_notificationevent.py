@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:50
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def classify_notifications(apps, schema_editor):
+    Notification = apps.get_model('base', 'Notification')
+    Comment = apps.get_model('base', 'Comment')
+
+    Notification.objects.filter(action_comment__isnull=True).update(verb='follow')
+    Notification.objects.filter(action_comment__isnull=False).update(
+        verb='comment',
+        action_post=Subquery(Comment.objects.filter(pk=OuterRef('action_comment')).values('post')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0012_userprofile_unread_notifications_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='actor_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='verb',
+            field=models.CharField(blank=True, choices=[('follow', 'Follow'), ('comment', 'Comment'), ('like', 'Like')], max_length=16),
+        ),
+        migrations.CreateModel(
+            name='NotificationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('verb', models.CharField(choices=[('follow', 'Follow'), ('comment', 'Comment'), ('like', 'Like')], max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('action_comment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='base.comment')),
+                ('action_post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='base.post')),
+                ('action_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('recipient_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(classify_notifications, migrations.RunPython.noop),
+    ]
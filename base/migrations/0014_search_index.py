@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0013_notification_verb_actor_count_notificationevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('user', 'User'), ('hashtag', 'Hashtag')], max_length=16)),
+                ('label', models.CharField(max_length=255)),
+                ('popularity', models.PositiveIntegerField(default=0)),
+                ('hashtag', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='base.hashtag')),
+                ('user', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('user', 'User'), ('hashtag', 'Hashtag')], max_length=16)),
+                ('trigram', models.CharField(max_length=3)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trigrams', to='base.searchdocument')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'trigram', 'document'], name='search_trigram_idx')],
+                'unique_together': {('document', 'trigram')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('user', 'User'), ('hashtag', 'Hashtag')], max_length=16)),
+                ('term', models.CharField(max_length=300)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms', to='base.searchdocument')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'term'], name='search_term_idx')],
+            },
+        ),
+    ]
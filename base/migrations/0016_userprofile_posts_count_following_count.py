@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:53
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_profile_counters(apps, schema_editor):
+    UserProfile = apps.get_model('base', 'UserProfile')
+    Post = apps.get_model('base', 'Post')
+    Follow = apps.get_model('base', 'Follow')
+
+    posts = Post.objects.filter(user=OuterRef('user')).order_by().values('user')
+    following = Follow.objects.filter(follower=OuterRef('user')).order_by().values('follower')
+    UserProfile.objects.update(
+        posts_count=Coalesce(Subquery(posts.annotate(count=Count('*')).values('count')), 0),
+        following_count=Coalesce(Subquery(following.annotate(count=Count('*')).values('count')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0015_hashtagtrend_jobcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_profile_counters, migrations.RunPython.noop),
+    ]
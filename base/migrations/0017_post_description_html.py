@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0016_userprofile_posts_count_following_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='description_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
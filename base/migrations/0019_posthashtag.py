@@ -0,0 +1,61 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import OuterRef, Subquery
+
+
+def populate_created_at(apps, schema_editor):
+    Post = apps.get_model('base', 'Post')
+    PostHashtag = apps.get_model('base', 'PostHashtag')
+
+    PostHashtag.objects.update(
+        created_at=Subquery(Post.objects.filter(pk=OuterRef('post_id')).values('created_at')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0018_hot_path_indexes'),
+    ]
+
+    operations = [
+        # The automatic post/hashtag table becomes an explicit model, the table is kept as it is
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='PostHashtag',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.hashtag')),
+                        ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.post')),
+                    ],
+                    options={
+                        'db_table': 'base_post_hashtags',
+                        'unique_together': {('post', 'hashtag')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='post',
+                    name='hashtags',
+                    field=models.ManyToManyField(blank=True, related_name='posts', through='base.PostHashtag', to='base.hashtag'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='posthashtag',
+            name='created_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(populate_created_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='posthashtag',
+            name='created_at',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='posthashtag',
+            index=models.Index(fields=['hashtag', '-created_at', '-post'], name='post_hashtag_created_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0020_mediablob'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='follow',
+            name='follow_following_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='follow',
+            name='follow_follower_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['following', '-created_at', '-id'], name='follow_following_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['follower', '-created_at', '-id'], name='follow_follower_created_idx'),
+        ),
+    ]
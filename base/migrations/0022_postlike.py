@@ -0,0 +1,64 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import OuterRef, Subquery
+
+
+def populate_created_at(apps, schema_editor):
+    Post = apps.get_model('base', 'Post')
+    PostLike = apps.get_model('base', 'PostLike')
+
+    # The time of earlier likes is unknown, they are dated when the post was created
+    PostLike.objects.update(
+        created_at=Subquery(Post.objects.filter(pk=OuterRef('post_id')).values('created_at')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('base', '0021_follow_keyset_indexes'),
+    ]
+
+    operations = [
+        # The automatic post/user likes table becomes an explicit model, the table is kept as it is
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='PostLike',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.post')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'base_post_likes',
+                        'unique_together': {('post', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='post',
+                    name='likes',
+                    field=models.ManyToManyField(blank=True, related_name='postlikes', through='base.PostLike', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='postlike',
+            name='created_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(populate_created_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='postlike',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AddIndex(
+            model_name='postlike',
+            index=models.Index(fields=['post', '-created_at', '-id'], name='post_like_created_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def record_latest_actors(apps, schema_editor):
+    Notification = apps.get_model('base', 'Notification')
+    NotificationActor = apps.get_model('base', 'NotificationActor')
+
+    # Only the latest actor of earlier notifications is known
+    actors = Notification.objects.order_by().values_list('id', 'action_user_id').iterator(chunk_size=2000)
+    batch = []
+    for notification_id, user_id in actors:
+        batch.append(NotificationActor(notification_id=notification_id, user_id=user_id))
+        if len(batch) == 2000:
+            NotificationActor.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    NotificationActor.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0023_account_deletion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='action_comment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='comments', to='base.comment'),
+        ),
+        migrations.CreateModel(
+            name='NotificationActor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actors', to='base.notification')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('notification', 'user')},
+            },
+        ),
+        migrations.RunPython(record_latest_actors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0024_notificationactor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobcheckpoint',
+            name='last_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
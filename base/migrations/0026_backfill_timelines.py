@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def backfill_timelines(apps, schema_editor):
+    """Fill the timelines of the existing follows, as base.timeline.backfill does for a new follow."""
+    Follow = apps.get_model('base', 'Follow')
+    Post = apps.get_model('base', 'Post')
+    TimelineEntry = apps.get_model('base', 'TimelineEntry')
+    UserProfile = apps.get_model('base', 'UserProfile')
+
+    fanout_limit = getattr(settings, 'TIMELINE_FANOUT_LIMIT', 5000)
+    backfill_size = getattr(settings, 'TIMELINE_BACKFILL_SIZE', 100)
+
+    # Authors over the limit are merged into the feeds at read time
+    authors = UserProfile.objects.filter(followers_count__gt=0, followers_count__lte=fanout_limit)
+    batch = []
+    for author_id in authors.order_by('user_id').values_list('user_id', flat=True).iterator(chunk_size=2000):
+        posts = list(
+            Post.objects.filter(user_id=author_id).order_by('-created_at').values_list('id', 'created_at')[:backfill_size]
+        )
+        if not posts:
+            continue
+        followers = Follow.objects.filter(following_id=author_id).order_by().values_list('follower_id', flat=True)
+        for follower_id in followers.iterator(chunk_size=2000):
+            for post_id, created_at in posts:
+                batch.append(TimelineEntry(user_id=follower_id, post_id=post_id, created_at=created_at))
+            if len(batch) >= 2000:
+                TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0025_jobcheckpoint_last_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
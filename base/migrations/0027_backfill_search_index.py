@@ -0,0 +1,92 @@
+from django.db import migrations
+from django.db.models import Count
+
+BATCH_SIZE = 500
+
+
+# Copies of base.search.normalize and base.search.trigrams as of this migration
+def normalize(text):
+    return ' '.join(str(text).lower().split())
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def index_documents(apps, kind, items):
+    # The document kinds are named after their foreign key
+    field = kind
+    SearchDocument = apps.get_model('base', 'SearchDocument')
+    SearchTerm = apps.get_model('base', 'SearchTerm')
+    SearchTrigram = apps.get_model('base', 'SearchTrigram')
+
+    SearchDocument.objects.bulk_create([
+        SearchDocument(kind=kind, label=label, popularity=popularity, **{f'{field}_id': pk})
+        for pk, label, terms, popularity in items
+    ])
+    documents = dict(
+        SearchDocument.objects.filter(**{f'{field}_id__in': [pk for pk, *rest in items]})
+        .values_list(f'{field}_id', 'id')
+    )
+    search_terms = []
+    search_trigrams = []
+    for pk, label, terms, popularity in items:
+        grams = set()
+        for term in terms:
+            search_terms.append(SearchTerm(document_id=documents[pk], kind=kind, term=term))
+            grams |= trigrams(term)
+        search_trigrams.extend(SearchTrigram(document_id=documents[pk], kind=kind, trigram=gram) for gram in grams)
+    SearchTerm.objects.bulk_create(search_terms, batch_size=BATCH_SIZE)
+    SearchTrigram.objects.bulk_create(search_trigrams, batch_size=BATCH_SIZE)
+
+
+def index_existing_rows(apps, schema_editor):
+    """Index the users and hashtags created before the search index, as rebuild_search_index does."""
+    User = apps.get_model('base', 'User')
+    Hashtag = apps.get_model('base', 'Hashtag')
+
+    # The ids are read first, the documents are written to a table the queries join
+    user_ids = list(User.objects.filter(search_document__isnull=True).order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(user_ids), BATCH_SIZE):
+        users = User.objects.filter(pk__in=user_ids[start:start + BATCH_SIZE]).values_list(
+            'pk', 'username', 'first_name', 'last_name', 'userprofile__followers_count',
+        )
+        batch = []
+        for pk, username, first_name, last_name, followers_count in users:
+            terms = {normalize(username)}
+            full_name = normalize(f'{first_name} {last_name}')
+            if full_name:
+                terms.add(full_name)
+                terms.update(full_name.split())
+            batch.append((pk, username, terms, followers_count or 0))
+        index_documents(apps, 'user', batch)
+
+    hashtag_ids = list(
+        Hashtag.objects.filter(search_document__isnull=True).order_by('pk').values_list('pk', flat=True)
+    )
+    for start in range(0, len(hashtag_ids), BATCH_SIZE):
+        hashtags = Hashtag.objects.filter(pk__in=hashtag_ids[start:start + BATCH_SIZE]).values_list('pk', 'name')
+        index_hashtags(apps, list(hashtags))
+
+
+def index_hashtags(apps, batch):
+    """Index ``batch``, a list of ``(pk, name)`` hashtags, ranked by their number of posts."""
+    PostHashtag = apps.get_model('base', 'PostHashtag')
+    post_counts = dict(
+        PostHashtag.objects.filter(hashtag_id__in=[pk for pk, name in batch]).order_by()
+        .values('hashtag_id').annotate(count=Count('*')).values_list('hashtag_id', 'count')
+    )
+    index_documents(apps, 'hashtag', [
+        (pk, name, {normalize(name)}, post_counts.get(pk, 0)) for pk, name in batch
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0026_backfill_timelines'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_existing_rows, migrations.RunPython.noop),
+    ]
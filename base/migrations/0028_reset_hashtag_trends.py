@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def reset_trends(apps, schema_editor):
+    """Drop the trends scored relative to the last run, the next update rebuilds them against the epoch."""
+    HashtagTrend = apps.get_model('base', 'HashtagTrend')
+    JobCheckpoint = apps.get_model('base', 'JobCheckpoint')
+
+    HashtagTrend.objects.all().delete()
+    JobCheckpoint.objects.filter(name__in=['trending_hashtags', 'trending_hashtags_full']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0027_backfill_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_trends, migrations.RunPython.noop),
+    ]
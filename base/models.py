@@ -1,28 +1,86 @@
 import re
 import uuid
+from functools import lru_cache, partial
+from urllib.parse import quote
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Window
+from django.db.models.functions import Greatest, Lower, RowNumber
+from django.urls import get_script_prefix, reverse
+from django.utils import timezone
+from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
+from . import conditional, images, notifications, search, timeline
+
+HASHTAG_PATTERN = re.compile(r'#(\w+)')
+
+
+@lru_cache(maxsize=None)
+def hashtag_url_prefix(script_prefix):
+    # Cached per script prefix, reverse() includes it in the URL
+    return reverse('explore_hashtag', args=['_'])[:-1]
+
 
 class User(AbstractUser):
+    SEARCH_FIELDS = {'username', 'first_name', 'last_name'}
 
     def save(self, *args, **kwargs):
+        adding = self._state.adding
         super().save(*args, **kwargs)
         UserProfile.objects.get_or_create(user=self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or self.SEARCH_FIELDS.intersection(update_fields):
+            search.index_users([self])
+            if not adding:
+                # Usernames are shown on other users' pages
+                transaction.on_commit(conditional.bump_site_version)
 
 
 class UserProfile(models.Model):
     avatar = models.ImageField(blank=True)
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='userprofile')
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
+    posts_count = models.PositiveIntegerField(default=0, editable=False)
+    followers_count = models.PositiveIntegerField(default=0, editable=False)
+    following_count = models.PositiveIntegerField(default=0, editable=False)
+    unread_notifications_count = models.PositiveIntegerField(default=0, editable=False)
+
+    DENORMALIZED_FIELDS = (
+        'avatar_variants', 'posts_count', 'followers_count', 'following_count', 'unread_notifications_count'
+    )
 
     objects = models.Manager()
 
     def __str__(self):
         return f"@{self.user}"
 
+    def save(self, *args, **kwargs):
+        avatar_changed = bool(self.avatar) and not self.avatar._committed
+        replaced = None
+        if avatar_changed:
+            self.avatar_variants = {}
+            if not self._state.adding:
+                replaced = UserProfile.objects.filter(pk=self.pk).values_list('avatar', flat=True).first()
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Denormalized fields are maintained with targeted updates, never overwrite them from a stale instance
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DENORMALIZED_FIELDS
+            ]
+            if avatar_changed:
+                kwargs['update_fields'].append('avatar_variants')
+        super().save(*args, **kwargs)
+        if avatar_changed:
+            transaction.on_commit(partial(images.schedule, images.generate_avatar_derivatives, self.pk))
+            # Avatars are shown on other users' pages
+            transaction.on_commit(conditional.bump_site_version)
+        if replaced and replaced != self.avatar.name:
+            # Release the reference of the previous file in the content-addressed storage
+            transaction.on_commit(partial(self.avatar.storage.delete, replaced))
+
     @property
     def avatar_url(self):
         try:
@@ -31,13 +89,37 @@ class UserProfile(models.Model):
             img = self.get_default_avatar()
         return img
 
+    def avatar_variant_url(self, size):
+        variant = self.avatar_variants.get(size)
+        if variant and self.avatar:
+            return self.avatar.storage.url(variant['name'])
+        return self.avatar_url
+
+    @property
+    def avatar_small_url(self):
+        return self.avatar_variant_url('small')
+
+    @property
+    def avatar_medium_url(self):
+        return self.avatar_variant_url('medium')
+
     @staticmethod
     def get_default_avatar():
         url = settings.MEDIA_URL + 'default_user_avatar.jpg'
         return url
 
     def get_unread_val(self):
-        return Notification.objects.filter(is_read=False, recipient_user=self.user).count()
+        return self.unread_notifications_count
+
+    @staticmethod
+    def change_counter(user_id, field, delta):
+        if delta:
+            UserProfile.objects.filter(user_id=user_id).update(**{field: Greatest(F(field) + delta, 0)})
+            transaction.on_commit(partial(conditional.bump_user_versions, user_id))
+
+    @staticmethod
+    def change_unread_count(user_id, delta):
+        UserProfile.change_counter(user_id, 'unread_notifications_count', delta)
 
 class Hashtag(models.Model):
     name = models.CharField(max_length=255, unique=True)
@@ -47,6 +129,11 @@ class Hashtag(models.Model):
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            models.Index(Lower('name'), name='hashtag_name_lower_idx'),
+        ]
+
     def get_count(self):
         return self.posts.count()
 
@@ -57,9 +144,15 @@ class Post(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    likes = models.ManyToManyField(User, related_name='postlikes', blank=True)
-    user = models.ForeignKey(User, related_name='posts', on_delete=models.DO_NOTHING)
-    hashtags = models.ManyToManyField(Hashtag, related_name='posts', blank=True)
+    likes = models.ManyToManyField(User, through='PostLike', related_name='postlikes', blank=True)
+    user = models.ForeignKey(User, related_name='posts', on_delete=models.CASCADE)
+    hashtags = models.ManyToManyField(Hashtag, through='PostHashtag', related_name='posts', blank=True)
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    description_html = models.TextField(blank=True, editable=False)
+
+    DENORMALIZED_FIELDS = ('like_count', 'comment_count', 'image_variants')
 
     objects = models.Manager()
 
@@ -67,19 +160,113 @@ class Post(models.Model):
         return self.user.username
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        adding = self._state.adding
+        image_changed = bool(self.image) and not self.image._committed
+        replaced = None
+        if image_changed:
+            self.image_variants = {}
+            if not adding:
+                replaced = Post.objects.filter(pk=self.pk).values_list('image', flat=True).first()
+        self.description_html = self.render_description(self.description)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'description' in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'description_html']
+        if not adding and kwargs.get('update_fields') is None:
+            # Denormalized fields are maintained with targeted updates, never overwrite them from a stale instance
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DENORMALIZED_FIELDS
+            ]
+            if image_changed:
+                kwargs['update_fields'].append('image_variants')
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                UserProfile.change_counter(self.user_id, 'posts_count', 1)
         self.extract_and_associate_hashtags()
+        if adding:
+            timeline.fan_out_post(self)
+        if image_changed:
+            transaction.on_commit(partial(images.schedule, images.generate_post_derivatives, self.pk))
+        if replaced and replaced != self.image.name:
+            transaction.on_commit(partial(self.image.storage.delete, replaced))
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            # The notifications about the post go with it, all of them were sent to its author
+            unread = Notification.objects.filter(action_post_id=self.pk, is_read=False).count()
+            deleted, rows = super().delete(*args, **kwargs)
+            if deleted:
+                UserProfile.change_counter(self.user_id, 'posts_count', -1)
+                UserProfile.change_unread_count(self.user_id, -unread)
+                if self.image:
+                    transaction.on_commit(partial(self.image.storage.delete, self.image.name))
+        return deleted, rows
 
     def extract_and_associate_hashtags(self):
-        # Extract hashtags from the description
-        hashtag_pattern = re.compile(r'\#\w+')
-        hashtags = re.findall(hashtag_pattern, str(self.description))
+        Post.associate_hashtags([self])
 
-        # Update or create hashtags and associate them with this post
-        for hashtag_text in hashtags:
-            hashtag, created = Hashtag.objects.get_or_create(name=hashtag_text[1:])
-            hashtag.save()
-            self.hashtags.add(hashtag)
+    @staticmethod
+    def extract_hashtags(text):
+        return set(HASHTAG_PATTERN.findall(str(text)))
+
+    @staticmethod
+    def render_description(text):
+        """Escape ``text`` and link every hashtag to its explore page."""
+        text = str(text)
+        prefix = hashtag_url_prefix(get_script_prefix())
+        parts = []
+        position = 0
+        for match in HASHTAG_PATTERN.finditer(text):
+            name = match.group(1)
+            parts.append(escape(text[position:match.start()]))
+            parts.append(f'<a href="{prefix}{quote(name)}" class="text-decoration-none">#{escape(name)}</a>')
+            position = match.end()
+        parts.append(escape(text[position:]))
+        return ''.join(parts)
+
+    @classmethod
+    def associate_hashtags(cls, posts):
+        """
+        Bring the hashtags of the given posts in line with their descriptions.
+
+        Only the difference between the stored and the extracted tags is written, with a fixed
+        number of bulk queries no matter how many posts or tags are involved.
+        """
+        wanted = {post.pk: cls.extract_hashtags(post.description) for post in posts}
+        created_at = {post.pk: post.created_at for post in posts}
+        through = cls.hashtags.through
+
+        current = {}
+        stale_ids = []
+        rows = through.objects.filter(post_id__in=wanted).values_list('id', 'post_id', 'hashtag__name')
+        for row_id, post_id, name in rows:
+            if name in wanted[post_id]:
+                current.setdefault(post_id, set()).add(name)
+            else:
+                stale_ids.append(row_id)
+
+        missing = [
+            (post_id, name)
+            for post_id, names in wanted.items()
+            for name in names - current.get(post_id, set())
+        ]
+
+        with transaction.atomic():
+            if missing:
+                names = {name for post_id, name in missing}
+                Hashtag.objects.bulk_create([Hashtag(name=name) for name in names], ignore_conflicts=True)
+                hashtag_ids = dict(Hashtag.objects.filter(name__in=names).values_list('name', 'id'))
+                through.objects.bulk_create(
+                    [
+                        through(post_id=post_id, hashtag_id=hashtag_ids[name], created_at=created_at[post_id])
+                        for post_id, name in missing
+                    ],
+                    ignore_conflicts=True,
+                )
+                search.index_hashtags(Hashtag.objects.filter(name__in=names, search_document__isnull=True))
+            if stale_ids:
+                through.objects.filter(id__in=stale_ids).delete()
 
     @property
     def image_url(self):
@@ -89,19 +276,125 @@ class Post(models.Model):
             img = ''
         return img
 
+    def image_variant_url(self, size):
+        variant = self.image_variants.get(size)
+        if variant:
+            return self.image.storage.url(variant['name'])
+        return self.image_url
+
+    @property
+    def image_grid_url(self):
+        return self.image_variant_url('grid')
+
+    @property
+    def image_feed_url(self):
+        return self.image_variant_url('feed')
+
+    @property
+    def image_srcset(self):
+        variants = [self.image_variants[size] for size in ('feed', 'full') if size in self.image_variants]
+        return ', '.join(f"{self.image.storage.url(variant['name'])} {variant['width']}w" for variant in variants)
+
     def image_preview(self):
         return mark_safe(f'<img src = "{self.image_url}" width = "300"/>')
 
+    @property
+    def cache_version(self):
+        """Changes whenever the cached parts of the post card change: on edits, likes and comments."""
+        return f'{self.updated_at.timestamp()}-{self.like_count}-{self.comment_count}'
+
     @property
     def total_likes(self):
-        return self.likes.count()
+        return self.like_count
 
     @property
     def total_comments(self):
-        return self.comments.count()
+        return self.comment_count
+
+    def add_like(self, user):
+        """Like the post as ``user``. Returns False if the user already liked it."""
+        try:
+            with transaction.atomic():
+                # The unique (post, user) constraint decides between concurrent requests
+                PostLike.objects.create(post_id=self.pk, user_id=user.pk)
+                Post.objects.filter(pk=self.pk).update(like_count=F('like_count') + 1, updated_at=timezone.now())
+        except IntegrityError:
+            return False
+        transaction.on_commit(partial(conditional.bump_user_versions, user.pk))
+        if user.pk != self.user_id:
+            notifications.enqueue(Notification.LIKE, self.user_id, user.pk, post_id=self.pk)
+        return True
+
+    def remove_like(self, user):
+        """Remove the like of ``user``. Returns False if there was none."""
+        with transaction.atomic():
+            deleted, rows = PostLike.objects.filter(post_id=self.pk, user_id=user.pk).delete()
+            if deleted:
+                Post.objects.filter(pk=self.pk).update(
+                    like_count=Greatest(F('like_count') - 1, 0), updated_at=timezone.now()
+                )
+                transaction.on_commit(partial(conditional.bump_user_versions, user.pk))
+        return bool(deleted)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='post_created_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='post_user_created_idx'),
+        ]
+
+
+class PostLike(models.Model):
+    """A like of a post, with the time it was given so the likers can be listed newest first."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"{self.user_id} likes {self.post_id}"
+
+    class Meta:
+        db_table = 'base_post_likes'
+        unique_together = ['post', 'user']
+        indexes = [
+            models.Index(fields=['post', '-created_at', '-id'], name='post_like_created_idx'),
+        ]
+
+    @staticmethod
+    def followed_likers(user, post_ids, limit=3):
+        """Map each post to the ``limit`` most recent likers that ``user`` follows, in one query."""
+        if not user.is_authenticated or not post_ids:
+            return {}
+        likes = PostLike.objects.filter(post_id__in=post_ids, user__followers__follower=user).annotate(
+            rank=Window(RowNumber(), partition_by=F('post_id'), order_by=[F('created_at').desc(), F('id').desc()])
+        ).filter(rank__lte=limit).select_related('user').only('post_id', 'user__username')
+
+        # Ordered here, ordering the query by the rank would sort the likes in a temporary B-tree
+        likers = {}
+        for like in sorted(likes, key=lambda like: like.rank):
+            likers.setdefault(like.post_id, []).append(like.user)
+        return likers
+
+
+class PostHashtag(models.Model):
+    """A hashtag of a post, with a copy of post.created_at so a hashtag page is a range scan over one index."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"#{self.hashtag} on {self.post_id}"
+
+    class Meta:
+        db_table = 'base_post_hashtags'
+        unique_together = ['post', 'hashtag']
+        indexes = [
+            models.Index(fields=['hashtag', '-created_at', '-post'], name='post_hashtag_created_idx'),
+        ]
 
 
 class Follow(models.Model):
@@ -114,21 +407,56 @@ class Follow(models.Model):
     def __str__(self):
         return f"{self.follower.username} follows {self.following.username}"
 
+    @classmethod
+    def follow(cls, follower, following):
+        """Make ``follower`` follow ``following``. Returns False if they already did."""
+        try:
+            with transaction.atomic():
+                # The unique (follower, following) constraint decides between concurrent requests
+                cls(follower=follower, following=following).save()
+        except IntegrityError:
+            return False
+        return True
+
+    @classmethod
+    def unfollow(cls, follower, following):
+        """Returns False if ``follower`` was not following ``following``."""
+        relation = cls.objects.filter(follower=follower, following=following).first()
+        return relation is not None and relation.delete()[0] > 0
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                UserProfile.change_counter(self.following_id, 'followers_count', 1)
+                UserProfile.change_counter(self.follower_id, 'following_count', 1)
+                timeline.backfill(self.follower_id, self.following_id)
 
         # Create a notification when a user starts following another user
-        if self.following != self.follower:
-            message = 'started following you'
-            Notification.objects.create(action_user=self.follower, recipient_user=self.following, message=message)
+        if adding and self.following_id != self.follower_id:
+            notifications.enqueue(Notification.FOLLOW, self.following_id, self.follower_id)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            deleted, rows = super().delete(*args, **kwargs)
+            if deleted:
+                UserProfile.change_counter(self.following_id, 'followers_count', -1)
+                UserProfile.change_counter(self.follower_id, 'following_count', -1)
+                timeline.trim(self.follower_id, self.following_id)
+        return deleted, rows
 
     class Meta:
         unique_together = ['follower', 'following']
+        indexes = [
+            models.Index(fields=['following', '-created_at', '-id'], name='follow_following_created_idx'),
+            models.Index(fields=['follower', '-created_at', '-id'], name='follow_follower_created_idx'),
+        ]
 
 
 class Comment(models.Model):
     post = models.ForeignKey(Post, related_name='comments', on_delete=models.CASCADE)
-    user = models.ForeignKey(User, related_name='comments', on_delete=models.DO_NOTHING)
+    user = models.ForeignKey(User, related_name='comments', on_delete=models.CASCADE)
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -140,33 +468,72 @@ class Comment(models.Model):
         return f"@{self.user} | {self.text}"
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-
-        # Create a notification when a user starts following another user
-        if self.user != self.post.user:
-            message = 'added comment to your post'
-            Notification.objects.create(
-                action_user=self.user,
-                action_comment=self,
-                recipient_user=self.post.user,
-                message=message
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # The post page shows its comments, its updated_at validates the page
+            if adding:
+                Post.objects.filter(pk=self.post_id).update(
+                    comment_count=F('comment_count') + 1, updated_at=timezone.now()
+                )
+            else:
+                Post.objects.filter(pk=self.post_id).update(updated_at=timezone.now())
+
+        # Create a notification when a user comments on someone else's post
+        if adding and self.user_id != self.post.user_id:
+            notifications.enqueue(
+                Notification.COMMENT, self.post.user_id, self.user_id, post_id=self.post_id, comment_id=self.pk
             )
 
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            # A notification about this comment alone goes with it, coalesced ones keep the other actors
+            own_notifications = Notification.objects.filter(action_comment_id=self.pk, actor_count=1)
+            unread = list(own_notifications.filter(is_read=False).values_list('recipient_user_id', flat=True))
+            own_notifications.delete()
+            for recipient_id in unread:
+                UserProfile.change_unread_count(recipient_id, -1)
+
+            deleted, rows = super().delete(*args, **kwargs)
+            # A stale instance of a comment deleted meanwhile must not decrement the counter again
+            if deleted:
+                Post.objects.filter(pk=self.post_id).update(
+                    comment_count=Greatest(F('comment_count') - 1, 0), updated_at=timezone.now()
+                )
+        return deleted, rows
+
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['post', 'created_at', 'id'], name='comment_post_created_idx'),
+        ]
 
 
 class Notification(models.Model):
+    FOLLOW = 'follow'
+    COMMENT = 'comment'
+    LIKE = 'like'
+    VERB_CHOICES = [(FOLLOW, 'Follow'), (COMMENT, 'Comment'), (LIKE, 'Like')]
+    MESSAGES = {
+        FOLLOW: 'started following you',
+        COMMENT: 'added comment to your post',
+        LIKE: 'liked your post',
+    }
+
     recipient_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications_received')
 
     action_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications_sent')
     action_post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='posts', blank=True, null=True)
+    # The latest comment of a coalesced notification, deleting it must not delete the other actors' notification
     action_comment = models.ForeignKey(Comment,
-                                       on_delete=models.CASCADE,
+                                       on_delete=models.SET_NULL,
                                        related_name='comments',
                                        blank=True,
                                        null=True)
 
+    verb = models.CharField(max_length=16, choices=VERB_CHOICES, blank=True)
+    # Number of users whose actions were coalesced into this notification, action_user being the latest
+    actor_count = models.PositiveIntegerField(default=1)
     message = models.CharField(max_length=255)
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
@@ -176,5 +543,232 @@ class Notification(models.Model):
     def __str__(self):
         return self.message
 
+    @property
+    def other_actors_count(self):
+        return self.actor_count - 1
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding and not self.is_read:
+                UserProfile.change_unread_count(self.recipient_user_id, 1)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            deleted, rows = super().delete(*args, **kwargs)
+            if deleted and not self.is_read:
+                UserProfile.change_unread_count(self.recipient_user_id, -1)
+        return deleted, rows
+
+    def set_read(self, is_read):
+        with transaction.atomic():
+            # Only the request that actually flips the flag adjusts the counter
+            updated = Notification.objects.filter(pk=self.pk, is_read=not is_read).update(is_read=is_read)
+            UserProfile.change_unread_count(self.recipient_user_id, -updated if is_read else updated)
+            if updated:
+                transaction.on_commit(partial(notifications.publish, [self.recipient_user_id]))
+        self.is_read = is_read
+
+    @staticmethod
+    def mark_all_as_read(user):
+        with transaction.atomic():
+            updated = Notification.objects.filter(recipient_user=user, is_read=False).update(is_read=True)
+            UserProfile.change_unread_count(user.id, -updated)
+            if updated:
+                transaction.on_commit(partial(notifications.publish, [user.id]))
+        return updated
+
+    class Meta:
+        ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['recipient_user', '-timestamp'], name='notification_recipient_idx'),
+            models.Index(fields=['recipient_user', 'is_read', '-timestamp'], name='notification_unread_idx'),
+        ]
+
+
+class NotificationActor(models.Model):
+    """A user whose actions were coalesced into a notification, so they are only counted once."""
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='actors')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"@{self.user_id} in {self.notification_id}"
+
+    class Meta:
+        unique_together = ['notification', 'user']
+
+
+class TimelineEntry(models.Model):
+    """A post materialized into the followed-posts feed of one of its author's followers."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    # Copy of post.created_at so a page is a range scan over a single index
+    created_at = models.DateTimeField()
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"{self.post} in @{self.user} timeline"
+
+    class Meta:
+        ordering = ['-created_at']
+        unique_together = ['user', 'post']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_created_idx'),
+        ]
+
+
+class NotificationEvent(models.Model):
+    """A queued action waiting to be turned into a Notification by the process_notifications worker."""
+    verb = models.CharField(max_length=16, choices=Notification.VERB_CHOICES)
+    recipient_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    action_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    action_post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+', blank=True, null=True)
+    action_comment = models.ForeignKey(Comment, on_delete=models.CASCADE, related_name='+', blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"{self.verb} for @{self.recipient_user_id}"
+
+
+class SearchDocument(models.Model):
+    """Searchable entry for a user or a hashtag, see base.search."""
+    USER = 'user'
+    HASHTAG = 'hashtag'
+    KIND_CHOICES = [(USER, 'User'), (HASHTAG, 'Hashtag')]
+
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='search_document', blank=True, null=True)
+    hashtag = models.OneToOneField(Hashtag,
+                                   on_delete=models.CASCADE,
+                                   related_name='search_document',
+                                   blank=True,
+                                   null=True)
+    label = models.CharField(max_length=255)
+    popularity = models.PositiveIntegerField(default=0)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"{self.kind}: {self.label}"
+
+
+class SearchTerm(models.Model):
+    """Normalized term of a SearchDocument, scanned by prefix."""
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE, related_name='terms')
+    kind = models.CharField(max_length=16, choices=SearchDocument.KIND_CHOICES)
+    term = models.CharField(max_length=300)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return self.term
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'term'], name='search_term_idx'),
+        ]
+
+
+class SearchTrigram(models.Model):
+    """Three character substring of a SearchTerm, used to find infix matches."""
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE, related_name='trigrams')
+    kind = models.CharField(max_length=16, choices=SearchDocument.KIND_CHOICES)
+    trigram = models.CharField(max_length=3)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return self.trigram
+
     class Meta:
-        ordering = ['-timestamp']
\ No newline at end of file
+        unique_together = ['document', 'trigram']
+        indexes = [
+            models.Index(fields=['kind', 'trigram', 'document'], name='search_trigram_idx'),
+        ]
+
+
+class HashtagTrend(models.Model):
+    """Materialized popularity of a hashtag, maintained by the update_trending_hashtags command."""
+    hashtag = models.OneToOneField(Hashtag, on_delete=models.CASCADE, primary_key=True, related_name='trend')
+    total_posts = models.PositiveIntegerField(default=0)
+    # Number of posts using the tag, each weighted down exponentially with its age, stored as
+    # log2 of that number at base.trending.EPOCH so it does not change over time
+    score = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"#{self.hashtag_id}: {self.score:.2f}"
+
+    class Meta:
+        ordering = ['-score']
+        indexes = [
+            models.Index(fields=['-score'], name='hashtag_trend_score_idx'),
+        ]
+
+
+class JobCheckpoint(models.Model):
+    """Progress marker of an incremental background job."""
+    name = models.CharField(max_length=64, primary_key=True)
+    position = models.DateTimeField(blank=True, null=True)
+    # Highest id processed, for jobs following an auto-incremented table
+    last_id = models.BigIntegerField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"{self.name}: {self.position}"
+
+
+class MediaBlob(models.Model):
+    """An uploaded file stored once under its content hash, shared by every reference to it."""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+    @classmethod
+    def acquire(cls, name, size):
+        """Add a reference to the blob ``name``, creating its row for the first one."""
+        blob, created = cls.objects.get_or_create(name=name, defaults={'size': size, 'ref_count': 1})
+        if not created:
+            cls.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        return created
+
+    @classmethod
+    def release(cls, name):
+        """Drop a reference to the blob ``name`` and return whether it was the last one."""
+        blob = cls.objects.select_for_update().filter(name=name).first()
+        if blob is None:
+            return False
+        if blob.ref_count > 1:
+            cls.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+            return False
+        blob.delete()
+        return True
+
+
+class AccountDeletion(models.Model):
+    """An account queued for removal by the delete_accounts worker, with the last step it finished."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    step = models.CharField(max_length=32, blank=True)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f"@{self.user_id}: {self.step or 'queued'}"
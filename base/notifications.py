@@ -0,0 +1,186 @@
+"""
+Queued, coalescing notification pipeline.
+
+The request path only records a NotificationEvent. The process_notifications worker
+drains the queue in batches and merges events of the same kind for the same recipient
+and post into a single Notification row ("alice and 41 others liked your post"). The
+actors of each notification are recorded, so a user acting again is not counted twice.
+
+Once committed, new notifications and unread count changes are published through the
+broker to the recipient's open event streams.
+"""
+import asyncio
+import json
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import models
+from .broker import get_broker
+
+# Seconds between comments keeping idle event streams open through proxies
+KEEPALIVE_INTERVAL = 25
+# Milliseconds a client waits before reconnecting to a stream that was closed
+RECONNECT_DELAY = 30000
+
+
+def enqueue(verb, recipient_id, action_user_id, post_id=None, comment_id=None):
+    if recipient_id == action_user_id:
+        return
+    models.NotificationEvent.objects.create(
+        verb=verb,
+        recipient_user_id=recipient_id,
+        action_user_id=action_user_id,
+        action_post_id=post_id,
+        action_comment_id=comment_id,
+    )
+
+
+def coalescing_key(obj):
+    return obj.recipient_user_id, obj.verb, obj.action_post_id
+
+
+def process_events(batch_size=500):
+    """Turn up to ``batch_size`` queued events into notifications. Returns the number of events processed."""
+    Notification = models.Notification
+
+    with transaction.atomic():
+        events = list(models.NotificationEvent.objects.select_for_update().order_by('id')[:batch_size])
+        if not events:
+            return 0
+
+        groups = {}
+        for event in events:
+            groups.setdefault(coalescing_key(event), []).append(event)
+
+        # Unread notifications still waiting to be seen absorb new events for the same key
+        condition = Q()
+        for recipient_id, verb, post_id in groups:
+            condition |= Q(recipient_user_id=recipient_id, verb=verb, action_post_id=post_id)
+        existing = {}
+        for notification in Notification.objects.filter(condition, is_read=False).order_by('timestamp'):
+            existing[coalescing_key(notification)] = notification
+        # Users acting again, e.g. liking after unliking, are not counted twice
+        recorded = set(models.NotificationActor.objects.filter(
+            notification__in=[notification.pk for notification in existing.values()]
+        ).values_list('notification_id', 'user_id'))
+
+        now = timezone.now()
+        to_update = []
+        to_create = []
+        actors = {}
+        for key, group in groups.items():
+            group_actors = list(dict.fromkeys(event.action_user_id for event in group))
+            latest = group[-1]
+            notification = existing.get(key)
+            if notification:
+                new_actors = [
+                    actor for actor in group_actors
+                    if actor != notification.action_user_id and (notification.pk, actor) not in recorded
+                ]
+                notification.actor_count += len(new_actors)
+                notification.action_user_id = latest.action_user_id
+                notification.action_comment_id = latest.action_comment_id
+                notification.timestamp = now
+                to_update.append(notification)
+                actors[key] = new_actors
+            else:
+                to_create.append(Notification(
+                    verb=latest.verb,
+                    recipient_user_id=latest.recipient_user_id,
+                    action_user_id=latest.action_user_id,
+                    action_post_id=latest.action_post_id,
+                    action_comment_id=latest.action_comment_id,
+                    actor_count=len(group_actors),
+                    message=Notification.MESSAGES[latest.verb],
+                    timestamp=now,
+                ))
+                actors[key] = group_actors
+
+        if to_update:
+            Notification.objects.bulk_update(to_update, ['actor_count', 'action_user', 'action_comment', 'timestamp'])
+        if to_create:
+            Notification.objects.bulk_create(to_create)
+
+            # bulk_create skips Notification.save, so keep the unread counters in step here
+            created = {}
+            for notification in to_create:
+                created[notification.recipient_user_id] = created.get(notification.recipient_user_id, 0) + 1
+            for recipient_id, count in created.items():
+                models.UserProfile.change_unread_count(recipient_id, count)
+
+        models.NotificationActor.objects.bulk_create(
+            [
+                models.NotificationActor(notification_id=notification.pk, user_id=actor)
+                for notification in to_update + to_create
+                for actor in actors[coalescing_key(notification)]
+            ],
+            ignore_conflicts=True,
+        )
+
+        models.NotificationEvent.objects.filter(id__in=[event.id for event in events]).delete()
+        transaction.on_commit(partial(publish, list({key[0] for key in groups}), to_update + to_create))
+
+    return len(events)
+
+
+def channel(user_id):
+    return f'notifications:{user_id}'
+
+
+def publish(recipient_ids, notifications=()):
+    """Push the unread count of every recipient, with their new or updated ``notifications``, to their streams."""
+    usernames = {}
+    if notifications:
+        usernames = dict(models.User.objects.filter(
+            id__in={notification.action_user_id for notification in notifications}
+        ).values_list('id', 'username'))
+
+    messages = {
+        recipient_id: {'unread_count': unread_count, 'notifications': []}
+        for recipient_id, unread_count in models.UserProfile.objects.filter(
+            user_id__in=recipient_ids
+        ).values_list('user_id', 'unread_notifications_count')
+    }
+    for notification in notifications:
+        message = messages.get(notification.recipient_user_id)
+        if message is not None:
+            message['notifications'].append({
+                'actor': usernames.get(notification.action_user_id),
+                'others': notification.other_actors_count,
+                'message': notification.message,
+                'post_id': str(notification.action_post_id) if notification.action_post_id else None,
+            })
+
+    broker = get_broker()
+    for recipient_id, message in messages.items():
+        broker.publish(channel(recipient_id), message)
+
+
+def format_event(message):
+    return f'event: notifications\ndata: {json.dumps(message)}\n\n'
+
+
+async def stream(user_id, follow=True):
+    """
+    Server-sent events with the current unread count of the user, followed by every message
+    published for them. Without ``follow`` the stream ends after the first event and the
+    client reconnects later, which is how it degrades to polling outside of ASGI.
+    """
+    async with get_broker().subscribe(channel(user_id)) as queue:
+        unread_count = await sync_to_async(
+            models.UserProfile.objects.filter(user_id=user_id).values_list('unread_notifications_count', flat=True).first
+        )()
+        yield f'retry: {RECONNECT_DELAY}\n'
+        yield format_event({'unread_count': unread_count or 0, 'notifications': []})
+
+        while follow:
+            try:
+                message = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield format_event(message)
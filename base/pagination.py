@@ -0,0 +1,116 @@
+import base64
+import datetime
+import json
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode_value(value):
+    # DjangoJSONEncoder truncates microseconds, which would make the cursor skip rows
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f'Cannot encode {type(value).__name__} in a cursor')
+
+
+class KeysetPage:
+    """A single page of results returned by KeysetPaginator."""
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Cursor (keyset) paginator.
+
+    Pages are sliced with a ``WHERE (a, b) < (x, y)`` style filter on the ``ordering``
+    fields instead of OFFSET, so every page costs the same regardless of its depth.
+    The last ordering field has to be unique to give a stable order.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-created_at', '-id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, field.lstrip('-')) for field in self.ordering]
+        payload = json.dumps(values, default=_encode_value, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        except (TypeError, ValueError):
+            raise InvalidCursor(cursor)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidCursor(cursor)
+
+        opts = self.queryset.model._meta
+        try:
+            return [
+                opts.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except ValidationError:
+            raise InvalidCursor(cursor)
+
+    def get_keyset_filter(self, values):
+        """Build the lexicographic "comes after" condition for the given cursor values."""
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            step = Q(**{f'{name}__{lookup}': values[i]})
+            for previous, value in zip(self.ordering[:i], values[:i]):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def get_page(self, cursor=None):
+        queryset = self.queryset.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self.get_keyset_filter(self.decode_cursor(cursor)))
+
+        # Fetch one extra row to find out whether there is a next page
+        object_list = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(object_list) > self.per_page:
+            object_list = object_list[:self.per_page]
+            next_cursor = self.encode_cursor(object_list[-1])
+        return KeysetPage(object_list, next_cursor)
+
+
+class KeysetPaginationMixin:
+    """Mixin for views paginating their queryset with a KeysetPaginator."""
+    paginate_by = 12
+    keyset_ordering = ('-created_at', '-id')
+    cursor_kwarg = 'cursor'
+
+    def paginate_keyset(self, queryset, ordering=None):
+        paginator = KeysetPaginator(queryset, self.paginate_by, ordering or self.keyset_ordering)
+        try:
+            return paginator.get_page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404('Invalid page cursor.')
@@ -0,0 +1,124 @@
+"""
+Prefix and trigram search over usernames, display names and hashtag names.
+
+Every user and hashtag has a SearchDocument with its normalized terms (SearchTerm, used
+for index range scans on prefixes) and the trigrams of those terms (SearchTrigram, used
+to find substring matches without scanning the whole table). Results are ranked by
+prefix match first, then by the document popularity.
+"""
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from . import models
+
+# Upper bound for a ``term >= prefix AND term < prefix + MAX_CHAR`` range scan
+MAX_CHAR = '\U0010ffff'
+BATCH_SIZE = 500
+
+
+def normalize(text):
+    return ' '.join(str(text).lower().split())
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def user_terms(user):
+    terms = {normalize(user.username)}
+    full_name = normalize(f'{user.first_name} {user.last_name}')
+    if full_name:
+        terms.add(full_name)
+        terms.update(full_name.split())
+    return terms
+
+
+def hashtag_terms(hashtag):
+    return {normalize(hashtag.name)}
+
+
+def index_documents(kind, items):
+    """
+    (Re)index ``items``, a list of ``(obj, label, terms, popularity)`` tuples of the same kind.
+    """
+    if not items:
+        return
+    field = 'user' if kind == models.SearchDocument.USER else 'hashtag'
+
+    with transaction.atomic():
+        models.SearchDocument.objects.filter(**{f'{field}__in': [obj for obj, *rest in items]}).delete()
+        documents = models.SearchDocument.objects.bulk_create([
+            models.SearchDocument(kind=kind, label=label, popularity=popularity, **{field: obj})
+            for obj, label, terms, popularity in items
+        ])
+        # Not every backend returns primary keys from bulk_create
+        if documents and documents[0].pk is None:
+            created = models.SearchDocument.objects.filter(**{f'{field}__in': [obj for obj, *rest in items]})
+            by_object = {getattr(document, f'{field}_id'): document for document in created}
+            documents = [by_object[obj.pk] for obj, *rest in items]
+
+        search_terms = []
+        search_trigrams = []
+        for document, (obj, label, terms, popularity) in zip(documents, items):
+            grams = set()
+            for term in terms:
+                search_terms.append(models.SearchTerm(document=document, kind=kind, term=term))
+                grams |= trigrams(term)
+            search_trigrams.extend(
+                models.SearchTrigram(document=document, kind=kind, trigram=gram) for gram in grams
+            )
+        models.SearchTerm.objects.bulk_create(search_terms, batch_size=BATCH_SIZE)
+        models.SearchTrigram.objects.bulk_create(search_trigrams, batch_size=BATCH_SIZE)
+
+
+def index_users(users):
+    index_documents(models.SearchDocument.USER, [
+        (user, user.username, user_terms(user), user.userprofile.followers_count) for user in users
+    ])
+
+
+def index_hashtags(hashtags, popularity=0):
+    index_documents(models.SearchDocument.HASHTAG, [
+        (hashtag, hashtag.name, hashtag_terms(hashtag), popularity) for hashtag in hashtags
+    ])
+
+
+def refresh_popularity():
+    """Copy follower counts and hashtag post counts onto the search documents."""
+    followers = models.UserProfile.objects.filter(user=OuterRef('user')).values('followers_count')
+    models.SearchDocument.objects.filter(kind=models.SearchDocument.USER).update(
+        popularity=Coalesce(Subquery(followers), 0)
+    )
+    posts = (
+        models.Post.hashtags.through.objects.filter(hashtag=OuterRef('hashtag'))
+        .order_by().values('hashtag').annotate(count=Count('*')).values('count')
+    )
+    models.SearchDocument.objects.filter(kind=models.SearchDocument.HASHTAG).update(
+        popularity=Coalesce(Subquery(posts), 0)
+    )
+
+
+def search(kind, text):
+    """Return the SearchDocuments of ``kind`` matching ``text``, best matches first."""
+    query = normalize(text)
+    if not query:
+        return models.SearchDocument.objects.none()
+
+    prefix_terms = models.SearchTerm.objects.filter(kind=kind, term__gte=query, term__lt=query + MAX_CHAR)
+    matches = Q(id__in=prefix_terms.values('document'))
+
+    grams = trigrams(query)
+    if grams:
+        # Documents having every trigram of the query are verified against the real terms
+        candidates = (
+            models.SearchTrigram.objects.filter(kind=kind, trigram__in=grams)
+            .values('document').annotate(matched=Count('id')).filter(matched=len(grams))
+            .values('document')
+        )
+        substring_terms = models.SearchTerm.objects.filter(document__in=candidates, term__contains=query)
+        matches |= Q(id__in=substring_terms.values('document'))
+
+    return models.SearchDocument.objects.filter(matches, kind=kind).annotate(
+        is_prefix=Exists(prefix_terms.filter(document=OuterRef('pk')))
+    ).order_by('-is_prefix', '-popularity', 'label', 'id')
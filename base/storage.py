@@ -0,0 +1,160 @@
+"""
+Content-addressed media storage.
+
+Uploads are stored once under the SHA-256 of their content, ``cas/ab/cd/<hash><ext>``, and
+every post or avatar pointing at the same bytes shares that file. MediaBlob counts the
+references: saving adds one and ``delete()`` drops one, removing the file and its
+derivatives only when the last reference goes away. A stored name never changes content,
+so those files and the derivatives generated from them can be cached forever.
+
+The hashing upload handlers compute the digest while the request body is streamed to
+memory or to a temporary file, so the storage does not read the upload a second time.
+"""
+import hashlib
+import os
+import posixpath
+
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import transaction
+from django.views import static
+
+CAS_PREFIX = 'cas/'
+DERIVATIVES_PREFIX = 'derivatives/'
+IMMUTABLE_PREFIXES = (CAS_PREFIX, DERIVATIVES_PREFIX + CAS_PREFIX)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def content_name(digest, original_name):
+    extension = posixpath.splitext(original_name)[1].lower()[:10]
+    return f'{CAS_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def is_immutable(name):
+    return name.startswith(IMMUTABLE_PREFIXES)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage keeping every upload under its content hash.
+
+    Derivatives are saved by name under ``derivatives/``; they belong to the blob they
+    were generated from and are removed together with it.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        if name.startswith(DERIVATIVES_PREFIX):
+            return super().get_available_name(name, max_length)
+        # The final name is only known once the content is hashed
+        return name
+
+    def _save(self, name, content):
+        if name.startswith(DERIVATIVES_PREFIX):
+            return super()._save(name, content)
+        from .models import MediaBlob
+
+        name = content_name(getattr(content, 'content_hash', None) or self.hash(content), name)
+        # The blob row is locked until commit, a concurrent release cannot remove the file meanwhile
+        with transaction.atomic():
+            MediaBlob.acquire(name, content.size)
+            if not self.exists(name):
+                try:
+                    super()._save(name, content)
+                except FileExistsError:
+                    # Stored by a concurrent upload of the same content
+                    pass
+        return name
+
+    @staticmethod
+    def hash(content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def delete(self, name):
+        """Drop a reference to ``name``; content-addressed files are removed with the last one."""
+        if not name.startswith(CAS_PREFIX):
+            return super().delete(name)
+        from . import images
+        from .models import MediaBlob
+
+        with transaction.atomic():
+            if not MediaBlob.release(name):
+                return
+            super().delete(name)
+            self.delete_tree(images.derivative_dir(name))
+
+    def purge(self, name):
+        """
+        Remove ``name`` and its derivatives unless a post or a profile references it.
+
+        Returns whether the file was removed. The blob row is locked while the references are
+        checked again, so a concurrent upload of the same content waits for the outcome.
+        """
+        from . import images
+        from .models import MediaBlob, Post, UserProfile
+
+        with transaction.atomic():
+            MediaBlob.objects.select_for_update().get_or_create(name=name)
+            if Post.objects.filter(image=name).exists() or UserProfile.objects.filter(avatar=name).exists():
+                return False
+            MediaBlob.objects.filter(name=name).delete()
+            super().delete(name)
+            self.delete_tree(images.derivative_dir(name))
+        return True
+
+    def walk(self, name=''):
+        """Yield the names of the files under the directory ``name``, one directory at a time."""
+        directories, files = self.listdir(name)
+        for file in files:
+            yield posixpath.join(name, file)
+        for directory in directories:
+            yield from self.walk(posixpath.join(name, directory))
+
+    def delete_tree(self, name):
+        try:
+            directories, files = self.listdir(name)
+        except FileNotFoundError:
+            return
+        for directory in directories:
+            self.delete_tree(posixpath.join(name, directory))
+        for file in files:
+            super().delete(posixpath.join(name, file))
+        os.rmdir(self.path(name))
+
+
+class HashingUploadHandlerMixin:
+    """Compute the SHA-256 of the upload while it is received, as ``content_hash`` of the file."""
+
+    def new_file(self, *args, **kwargs):
+        # Before super(), the memory handler raises StopFutureHandlers when it takes the file
+        self.digest = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if getattr(self, 'activated', True):
+            self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_hash = self.digest.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def serve(request, path, document_root=None, show_indexes=False):
+    """Serve media in development, with far-future caching of the content-addressed files."""
+    response = static.serve(request, path, document_root, show_indexes)
+    if is_immutable(path):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
@@ -1,19 +1,12 @@
 from django import template
-from django.urls import reverse
 from django.utils.safestring import mark_safe
-import re
+
+from ..models import Post
 
 register = template.Library()
 
 
 @register.filter
 def hashtag(value):
-    def repl(match):
-        hashtag = match.group(1)
-        url = reverse('explore_hashtag', args=[hashtag[1:]])
-        return f'<a href="{url}" class="text-decoration-none">{hashtag}</a>'
-
-    pattern = r'(#\w+)'
-    result = re.sub(pattern, repl, value)
-
-    return mark_safe(result)
+    """Fallback for posts whose description_html has not been rendered yet."""
+    return mark_safe(Post.render_description(value))
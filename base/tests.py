@@ -1,3 +1,1287 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+import uuid
+from datetime import timedelta
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Max, Min
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import broker, db, deletion, images, metrics, notifications, search, storage, timeline, trending, views
+from .models import (
+    User, Post, PostLike, Comment, Follow, Notification, NotificationEvent, MediaBlob, AccountDeletion, HashtagTrend,
+    Hashtag, PostHashtag, SearchDocument, TimelineEntry, UserProfile,
+)
+
+
+class SeededTestCase(TestCase):
+    """A viewer and an author with followers, posts, likes, comments and notifications."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', None)
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+        Follow.objects.create(follower=cls.viewer, following=cls.author)
+        cls.post = Post.objects.create(user=cls.author, image='post.jpg', description='Sunset #photo')
+        cls.comment = Comment.objects.create(post=cls.post, user=cls.viewer, text='Nice one')
+        cls.seed(1)
+
+    @classmethod
+    def seed(cls, count):
+        """Add ``count`` users following, liking, commenting on and notifying the viewer and the author."""
+        start = User.objects.count()
+        for i in range(start, start + count):
+            fan = User.objects.create_user(f'fan{i}', f'fan{i}@example.com', None)
+            Follow.objects.create(follower=fan, following=cls.author)
+            Follow.objects.create(follower=fan, following=cls.viewer)
+            Follow.objects.create(follower=cls.viewer, following=fan)
+
+            post = Post.objects.create(user=fan, image=f'fan{i}.jpg', description=f'Post {i} #photo #fan{i}')
+            cls.post.add_like(fan)
+            post.add_like(cls.viewer)
+            post.add_like(cls.author)
+            Comment.objects.create(post=cls.post, user=fan, text=f'Comment {i}')
+            comment = Comment.objects.create(post=post, user=cls.author, text=f'Reply {i}')
+
+            Notification.objects.create(
+                verb=Notification.COMMENT,
+                recipient_user=cls.viewer,
+                action_user=fan,
+                action_post=post,
+                action_comment=comment,
+                message=Notification.MESSAGES[Notification.COMMENT],
+            )
+        notifications.process_events()
+
+
+class QueryBudgetTests(SeededTestCase):
+    """
+    Every route has an upper bound on the number of SQL queries and the time spent in SQL.
+
+    Each view is measured against the seeded data and again after ten times as many users,
+    posts, comments, likes, follows and notifications were added; the query count has to
+    stay the same, so N+1 patterns fail here instead of in production.
+    """
+    # Seconds a single request may spend executing SQL against the local SQLite database
+    SQL_TIME_BUDGET = 0.25
+    GROWTH = 10
+
+    def measure(self, url, user):
+        if user:
+            self.client.force_login(user)
+        else:
+            self.client.logout()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertLess(response.status_code, 400, url)
+        sql_time = sum(float(query['time']) for query in context.captured_queries)
+        return len(context.captured_queries), sql_time
+
+    def assertQueryBudget(self, url, budget):
+        users = {'anonymous': None, 'viewer': self.viewer}
+
+        counts = {}
+        for name, user in users.items():
+            counts[name] = self.measure(url, user)
+
+        self.seed(self.GROWTH - 1)
+
+        for name, user in users.items():
+            with self.subTest(user=name):
+                count, sql_time = self.measure(url, user)
+                self.assertLessEqual(count, budget, f'{url} as {name} ran {count} queries')
+                self.assertEqual(count, counts[name][0], f'{url} as {name} query count grows with the data')
+                self.assertLess(sql_time, self.SQL_TIME_BUDGET, f'{url} as {name} spent {sql_time:.3f}s in SQL')
+
+    def test_index(self):
+        self.assertQueryBudget(reverse('index'), 6)
+
+    def test_posts_followed(self):
+        self.assertQueryBudget(reverse('posts_followed'), 8)
+
+    def test_search_users(self):
+        self.assertQueryBudget(reverse('search') + '?text=fan&choice=user', 6)
+
+    def test_search_hashtags(self):
+        self.assertQueryBudget(reverse('search') + '?text=fan&choice=hashtag', 5)
+
+    def test_explore(self):
+        self.assertQueryBudget(reverse('explore'), 4)
+
+    def test_explore_hashtag(self):
+        self.assertQueryBudget(reverse('explore_hashtag', args=['photo']), 9)
+
+    def test_post_user_grid(self):
+        self.assertQueryBudget(reverse('post_user_grid', args=[self.author.username]), 6)
+
+    def test_user_followers(self):
+        self.assertQueryBudget(reverse('user_followers', args=[self.author.username]), 6)
+
+    def test_user_following(self):
+        self.assertQueryBudget(reverse('user_following', args=[self.viewer.username]), 6)
+
+    def test_user_profile_edit(self):
+        self.assertQueryBudget(reverse('user_profile_edit'), 5)
+
+    def test_notifications(self):
+        self.assertQueryBudget(reverse('notifications'), 4)
+
+    def test_post_add(self):
+        self.assertQueryBudget(reverse('post_add'), 3)
+
+    def test_post_details(self):
+        self.assertQueryBudget(reverse('post_details', args=[self.post.pk]), 6)
+
+    def test_post_likes(self):
+        self.assertQueryBudget(reverse('post_likes', args=[self.post.pk]), 6)
+
+    def test_post_update(self):
+        self.assertQueryBudget(reverse('post_update', args=[self.post.pk]), 4)
+
+    def test_post_delete(self):
+        self.assertQueryBudget(reverse('post_delete', args=[self.post.pk]), 4)
+
+    def test_comment_update(self):
+        self.assertQueryBudget(reverse('comment_update', args=[self.comment.pk]), 4)
+
+    def test_comment_delete(self):
+        self.assertQueryBudget(reverse('comment_delete', args=[self.comment.pk]), 4)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics(self):
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer secret'
+        self.assertQueryBudget(reverse('metrics'), 2)
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+
+    def test_request_metrics(self):
+        response = self.client.get(reverse('index'))
+        self.assertIn('sql;desc="1 queries"', response['Server-Timing'])
+
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        body = response.content.decode()
+        self.assertIn('http_requests_total{view="index",method="GET",status="200"} 1', body)
+        self.assertIn('http_request_sql_queries_bucket{view="index",le="1"} 1', body)
+        self.assertIn('http_request_template_duration_seconds_count{view="index"} 1', body)
+        self.assertIn('http_response_size_bytes_count{view="index"} 1', body)
+
+    async def test_sync_view_queries_counted_under_asgi(self):
+        # The view runs in a sync_to_async thread, the queries are counted there
+        response = await self.async_client.get(reverse('index'))
+        self.assertIn('sql;desc="1 queries"', response['Server-Timing'])
+
+    def test_metrics_are_internal(self):
+        # Requests forwarded by a local reverse proxy come from 127.0.0.1 too
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1').status_code, 404)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 404)
+
+        self.client.force_login(User.objects.create_user('admin', 'admin@example.com', None, is_staff=True))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+class QueryPlanTests(SeededTestCase):
+    """
+    The queries of every page must be answered from indexes: a full scan of a table that
+    grows with the number of users, or sorting its rows in a temporary B-tree, fails.
+    """
+    LARGE_TABLES = {
+        'base_user', 'base_userprofile', 'base_post', 'base_post_likes', 'base_post_hashtags', 'base_comment',
+        'base_follow', 'base_notification', 'base_notificationevent', 'base_timelineentry',
+        'base_searchdocument', 'base_searchterm', 'base_searchtrigram', 'django_session',
+    }
+    TABLE_ALIAS = re.compile(r'"(\w+)" (\w+)')
+
+    def get_plan_problems(self, sql, allow_sort):
+        tables = {alias: table for table, alias in self.TABLE_ALIAS.findall(sql)}
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            details = [row[-1] for row in cursor.fetchall()]
+
+        problems = []
+        for detail in details:
+            words = detail.split()
+            if words[0] == 'SCAN' and 'USING' not in words and tables.get(words[1], words[1]) in self.LARGE_TABLES:
+                problems.append(detail)
+            if 'TEMP B-TREE' in detail and not allow_sort:
+                problems.append(detail)
+        return problems
+
+    def assertIndexedPlans(self, url, allow_sort=False):
+        self.client.force_login(self.viewer)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertLess(response.status_code, 400, url)
+
+        for query in context.captured_queries:
+            sql = query['sql']
+            if sql.split(' ', 1)[0] not in ('SELECT', 'UPDATE', 'DELETE'):
+                continue
+            with self.subTest(sql=sql):
+                self.assertEqual(self.get_plan_problems(sql, allow_sort), [], sql)
+
+    def test_feeds(self):
+        self.assertIndexedPlans(reverse('index'))
+        self.assertIndexedPlans(reverse('posts_followed'))
+        self.assertIndexedPlans(reverse('explore'))
+        self.assertIndexedPlans(reverse('explore_hashtag', args=['PHOTO']))
+
+    def test_profile_pages(self):
+        self.assertIndexedPlans(reverse('post_user_grid', args=[self.author.username]))
+        self.assertIndexedPlans(reverse('user_followers', args=[self.author.username]))
+        self.assertIndexedPlans(reverse('user_following', args=[self.viewer.username]))
+        self.assertIndexedPlans(reverse('user_profile_edit'))
+
+    def test_post_pages(self):
+        self.assertIndexedPlans(reverse('post_details', args=[self.post.pk]))
+        self.assertIndexedPlans(reverse('post_likes', args=[self.post.pk]))
+
+    def test_notifications(self):
+        self.assertIndexedPlans(reverse('notifications'))
+
+    def test_hashtag_page(self):
+        self.seed(13)
+        self.client.force_login(self.viewer)
+        response = self.client.get(reverse('explore_hashtag', args=['PHOTO']))
+        self.assertEqual(response.context['hashtag_count'], 15)
+        first_page = [post['id'] for post in response.context['posts']]
+        self.assertEqual(len(first_page), 12)
+
+        response = self.client.get(
+            reverse('explore_hashtag', args=['photo']), {'cursor': response.context['next_cursor']}
+        )
+        second_page = [post['id'] for post in response.context['posts']]
+        self.assertEqual(len(second_page), 3)
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertEqual(len(set(first_page + second_page)), 15)
+        self.assertEqual(
+            first_page + second_page,
+            list(Post.objects.filter(hashtags__name='photo').order_by('-created_at', '-id').values_list('pk', flat=True))
+        )
+
+    def test_search(self):
+        # Ranking sorts the matching documents only
+        self.assertIndexedPlans(reverse('search') + '?text=fan&choice=user', allow_sort=True)
+        self.assertIndexedPlans(reverse('search') + '?text=fan&choice=hashtag', allow_sort=True)
+
+
+class IndexFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+        posts = [Post.objects.create(user=cls.author, description=f'Day {i}') for i in range(7)]
+        # Posts created at the same instant are ordered by id
+        Post.objects.filter(pk__in=[post.pk for post in posts[2:5]]).update(created_at=posts[2].created_at)
+
+    @mock.patch.object(views.AllPostsListView, 'paginate_by', 2)
+    def test_cursor_round_trip(self):
+        listed = []
+        cursor = None
+        while True:
+            response = self.client.get(reverse('index'), {'cursor': cursor} if cursor else {})
+            self.assertEqual(response.status_code, 200)
+            listed += [post['id'] for post in response.context['posts']]
+            cursor = response.context['next_cursor']
+            if not cursor:
+                break
+        expected = Post.objects.order_by('-created_at', '-id').values_list('pk', flat=True)
+        self.assertEqual(listed, list(expected))
+
+    def test_malformed_cursor(self):
+        for cursor in ('not-a-cursor', 'W10', 'WyJ4Il0'):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(reverse('index'), {'cursor': cursor}).status_code, 404)
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', None)
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+        cls.other = User.objects.create_user('other', 'other@example.com', None)
+        cls.old_post = Post.objects.create(user=cls.author, description='Before the follow')
+
+    def feed(self, **params):
+        self.client.force_login(self.viewer)
+        response = self.client.get(reverse('posts_followed'), params)
+        return [post['description'] for post in response.context['posts']], response.context['next_cursor']
+
+    def test_follow_backfills_and_posts_fan_out(self):
+        Follow.follow(self.viewer, self.author)
+        Post.objects.create(user=self.author, description='After the follow')
+        Post.objects.create(user=self.other, description='Not followed')
+        self.assertEqual(TimelineEntry.objects.filter(user=self.viewer).count(), 2)
+        self.assertEqual(self.feed()[0], ['After the follow', 'Before the follow'])
+
+        Follow.unfollow(self.viewer, self.author)
+        self.assertFalse(TimelineEntry.objects.filter(user=self.viewer).exists())
+        self.assertEqual(self.feed()[0], [])
+
+    def test_migration_backfills_existing_follows(self):
+        Follow.follow(self.viewer, self.author)
+        Follow.follow(self.other, self.author)
+        TimelineEntry.objects.all().delete()
+
+        import_module('base.migrations.0026_backfill_timelines').backfill_timelines(apps, None)
+        self.assertEqual(
+            set(TimelineEntry.objects.values_list('user_id', 'post_id')),
+            {(self.viewer.pk, self.old_post.pk), (self.other.pk, self.old_post.pk)},
+        )
+
+    @mock.patch.object(views.AllPostsListView, 'paginate_by', 2)
+    def test_popular_authors_merged_at_read_time(self):
+        Follow.follow(self.viewer, self.other)
+        with mock.patch.object(timeline, 'FANOUT_LIMIT', 0):
+            Follow.follow(self.viewer, self.author)
+            Post.objects.create(user=self.other, description='Fanned out')
+            Post.objects.create(user=self.author, description='Merged')
+            self.assertFalse(TimelineEntry.objects.filter(post__user=self.author).exists())
+
+            descriptions, cursor = self.feed()
+            self.assertEqual(descriptions, ['Merged', 'Fanned out'])
+            self.assertEqual(self.feed(cursor=cursor), (['Before the follow'], None))
+
+
+class ProfileGridTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+        cls.posts = [Post.objects.create(user=cls.author, description=f'Day {i}') for i in range(5)]
+
+    def posts_count(self):
+        return UserProfile.objects.get(user=self.author).posts_count
+
+    def test_posts_count_maintained(self):
+        self.assertEqual(self.posts_count(), 5)
+        self.posts[0].description = 'Edited'
+        self.posts[0].save()
+        self.assertEqual(self.posts_count(), 5)
+
+        stale = Post.objects.get(pk=self.posts[1].pk)
+        self.posts[1].delete()
+        stale.delete()
+        self.assertEqual(self.posts_count(), 4)
+        response = self.client.get(reverse('post_user_grid', args=['author']))
+        self.assertEqual(response.context['posts_count'], 4)
+
+    @mock.patch.object(views.PostUserGridView, 'paginate_by', 2)
+    def test_paginated_by_cursor(self):
+        url = reverse('post_user_grid', args=['author'])
+        listed = []
+        cursor = None
+        while True:
+            response = self.client.get(url, {'cursor': cursor} if cursor else {})
+            self.assertLessEqual(len(response.context['posts']), 2)
+            listed += [post.pk for post in response.context['posts']]
+            cursor = response.context['next_cursor']
+            if not cursor:
+                break
+        expected = Post.objects.filter(user=self.author).order_by('-created_at', '-id').values_list('pk', flat=True)
+        self.assertEqual(listed, list(expected))
+
+        self.assertEqual(self.client.get(url, {'cursor': 'not-a-cursor'}).status_code, 404)
+
+
+class FollowListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', None)
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+        cls.fans = [User.objects.create_user(f'fan{i}', f'fan{i}@example.com', None) for i in range(5)]
+        for fan in cls.fans:
+            Follow.follow(fan, cls.author)
+        Follow.follow(cls.viewer, cls.fans[3])
+
+    @mock.patch.object(views.UserFollowersView, 'paginate_by', 2)
+    def test_paginated_by_follow_time(self):
+        self.client.force_login(self.viewer)
+        url = reverse('user_followers', args=[self.author.username])
+        listed = []
+        cursor = None
+        while True:
+            response = self.client.get(url, {'cursor': cursor} if cursor else {})
+            listed += [(user.username, user.is_followed) for user in response.context['users']]
+            cursor = response.context['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(listed, [
+            ('fan4', False), ('fan3', True), ('fan2', False), ('fan1', False), ('fan0', False),
+        ])
+
+    def test_following(self):
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('user_following', args=[self.viewer.username]))
+        self.assertEqual([user.username for user in response.context['users']], ['fan3'])
+        self.assertContains(response, reverse('user_follow', args=['fan3']))
+        self.assertEqual(self.client.get(reverse('user_following', args=['nobody'])).status_code, 404)
+
+
+class LikersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', None)
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+        cls.post = Post.objects.create(user=cls.author, image='post.jpg', description='Sunset')
+        cls.fans = [User.objects.create_user(f'fan{i}', f'fan{i}@example.com', None) for i in range(6)]
+        for fan in cls.fans:
+            cls.post.add_like(fan)
+        for fan in cls.fans[1:6]:
+            Follow.objects.create(follower=cls.viewer, following=fan)
+
+    @mock.patch.object(views.PostLikesView, 'paginate_by', 4)
+    def test_paginated_by_like_time(self):
+        url = reverse('post_likes', args=[self.post.pk])
+        response = self.client.get(url)
+        self.assertEqual([user.username for user in response.context['likers']], ['fan5', 'fan4', 'fan3', 'fan2'])
+        response = self.client.get(url, {'cursor': response.context['next_cursor']})
+        self.assertEqual([user.username for user in response.context['likers']], ['fan1', 'fan0'])
+        self.assertIsNone(response.context['next_cursor'])
+
+    def test_followed_likers(self):
+        likers = PostLike.followed_likers(self.viewer, [self.post.pk])
+        self.assertEqual([user.username for user in likers[self.post.pk]], ['fan5', 'fan4', 'fan3'])
+        self.assertEqual(PostLike.followed_likers(self.author, [self.post.pk]), {})
+
+        self.client.force_login(self.viewer)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'and 3 others')
+        self.assertContains(response, reverse('post_user_grid', args=['fan5']))
+
+
+class CommentThreadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+        cls.post = Post.objects.create(user=cls.author, image='post.jpg', description='Sunset')
+        cls.comments = [Comment.objects.create(post=cls.post, user=cls.author, text=f'Comment {i}') for i in range(5)]
+        cls.comments[1].likes.add(cls.author)
+
+    def get_comments(self, **params):
+        response = self.client.get(reverse('post_details', args=[self.post.pk]), params)
+        return [comment.text for comment in response.context['comments']], response.context['next_cursor']
+
+    @mock.patch.object(views.PostDetailView, 'comments_per_page', 3)
+    def test_paginated_in_both_orders(self):
+        texts, cursor = self.get_comments()
+        self.assertEqual(texts, ['Comment 0', 'Comment 1', 'Comment 2'])
+        self.assertEqual(self.get_comments(cursor=cursor), (['Comment 3', 'Comment 4'], None))
+
+        texts, cursor = self.get_comments(order='newest')
+        self.assertEqual(texts, ['Comment 4', 'Comment 3', 'Comment 2'])
+        self.assertEqual(self.get_comments(order='newest', cursor=cursor), (['Comment 1', 'Comment 0'], None))
+
+    def test_like_counts_and_comment_form(self):
+        response = self.client.get(reverse('post_details', args=[self.post.pk]))
+        self.assertEqual([comment.like_count for comment in response.context['comments']], [0, 1, 0, 0, 0])
+        self.assertEqual(self.client.get(reverse('post_details', args=[self.post.pk]), {'cursor': 'x'}).status_code, 404)
+
+        self.client.force_login(self.author)
+        response = self.client.post(reverse('post_details', args=[self.post.pk]), {'text': 'Reply'})
+        self.assertRedirects(response, reverse('post_details', args=[self.post.pk]))
+        self.assertEqual(self.get_comments(order='newest')[0][0], 'Reply')
+
+    def test_deleting_stale_instance_keeps_count(self):
+        first, stale = Comment.objects.get(pk=self.comments[0].pk), Comment.objects.get(pk=self.comments[0].pk)
+        self.assertEqual(first.delete()[0], 1)
+        self.assertEqual(stale.delete()[0], 0)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).comment_count, 4)
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', None)
+        cls.post = Post.objects.create(user=cls.author, image='post.jpg', description='Sunset')
+
+    def assertNotModified(self, url, response):
+        with CaptureQueriesContext(connection) as queries:
+            revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], response['ETag'])
+        return len(queries)
+
+    def test_unchanged_pages_not_modified(self):
+        for url in (reverse('index'), reverse('post_details', args=[self.post.pk]), reverse('post_user_grid', args=['author'])):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertLessEqual(self.assertNotModified(url, response), len(queries))
+            self.assertEqual(response['Cache-Control'], 'public, max-age=30')
+            self.assertIn('Cookie', response['Vary'])
+            self.assertNotIn('csrftoken', response.cookies)
+
+    def test_changes_invalidate_etag(self):
+        url = reverse('post_details', args=[self.post.pk])
+        self.client.force_login(self.viewer)
+        response = self.client.get(url)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertNotIn('Last-Modified', response)
+        self.assertNotModified(url, response)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.add_like(self.viewer)
+        liked = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(liked.status_code, 200)
+        self.assertTrue(liked.context['post']['is_liked'])
+
+        Comment.objects.create(post=self.post, user=self.author, text='Nice')
+        commented = self.client.get(url, HTTP_IF_NONE_MATCH=liked['ETag'])
+        self.assertEqual(commented.status_code, 200)
+        self.assertContains(commented, 'Nice')
+
+    def test_missing_post_not_validated(self):
+        response = self.client.get(reverse('post_details', args=[uuid.uuid4()]))
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+
+    def test_new_csrf_secret_invalidates_etag(self):
+        url = reverse('post_details', args=[self.post.pk])
+        self.client.force_login(self.viewer)
+        response = self.client.get(url)
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+        self.assertNotModified(url, response)
+
+        # Logging in again rotates the secret the form tokens of the cached page were derived from
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = 'a' * 32
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotModified(url, response)
+
+
+class HashtagTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+
+    @mock.patch.object(views.HashtagPostListView, 'paginate_by', 2)
+    def test_spellings_of_a_tag_counted_once(self):
+        posts = [Post.objects.create(user=self.author, description=f'Day {i} #Sun #sun') for i in range(3)]
+        url = reverse('explore_hashtag', args=['sun'])
+        response = self.client.get(url)
+        self.assertEqual(response.context['hashtag_count'], 3)
+        self.assertEqual([post['id'] for post in response.context['posts']], [posts[2].pk, posts[1].pk])
+
+        # The later pages do not count the tagged posts again
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'cursor': response.context['next_cursor']})
+        self.assertEqual([post['id'] for post in response.context['posts']], [posts[0].pk])
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertIsNone(response.context['hashtag_count'])
+        self.assertFalse([query for query in queries.captured_queries if 'COUNT(' in query['sql']])
+
+    def test_edit_only_writes_changed_tags(self):
+        post = Post.objects.create(user=self.author, description='Beach #sun #sea')
+        kept = PostHashtag.objects.get(post=post, hashtag__name='sun')
+
+        post.description = 'Hills #sun #sky'
+        post.save()
+        self.assertEqual(set(post.hashtags.values_list('name', flat=True)), {'sun', 'sky'})
+        self.assertTrue(PostHashtag.objects.filter(pk=kept.pk).exists())
+        self.assertTrue(Hashtag.objects.filter(name='sea').exists())
+
+    def test_posts_diffed_in_fixed_number_of_queries(self):
+        posts = [Post.objects.create(user=self.author, description=f'Day {i} #sun') for i in range(3)]
+        for i, post in enumerate(posts):
+            post.description = f'Day {i} #sun #day{i}'
+        # Tag rows and the search index of the new tags, in bulk for all the posts
+        with self.assertNumQueries(13):
+            Post.associate_hashtags(posts)
+        for i, post in enumerate(posts):
+            self.assertEqual(set(post.hashtags.values_list('name', flat=True)), {'sun', f'day{i}'})
+
+        # Nothing changed, only the stored tags are read
+        with self.assertNumQueries(3):
+            Post.associate_hashtags(posts)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.joanna = User.objects.create_user('joanna', 'joanna@example.com', None)
+        cls.annabel = User.objects.create_user('annabel', 'annabel@example.com', None)
+        cls.hannah = User.objects.create_user('hannah', 'hannah@example.com', None, first_name='Ann', last_name='Lee')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', None)
+
+    def usernames(self, text):
+        return [document.label for document in search.search(SearchDocument.USER, text)]
+
+    def test_prefix_matches_first_then_popularity(self):
+        Follow.follow(self.bob, self.joanna)
+        Follow.follow(self.annabel, self.joanna)
+        Follow.follow(self.bob, self.hannah)
+        search.refresh_popularity()
+        # hannah matches through the first name, joanna only inside the username
+        self.assertEqual(self.usernames('  ANN '), ['hannah', 'annabel', 'joanna'])
+        self.assertEqual(self.usernames('ann lee'), ['hannah'])
+        self.assertEqual(self.usernames('xyz'), [])
+        self.assertEqual(self.usernames(''), [])
+
+    def test_short_queries_match_prefixes_only(self):
+        self.assertEqual(self.usernames('an'), ['annabel', 'hannah'])
+        self.assertEqual(self.usernames('bo'), ['bob'])
+
+    def test_renamed_user_reindexed(self):
+        self.bob.username = 'robert'
+        self.bob.save(update_fields=['username'])
+        self.assertEqual(self.usernames('bob'), [])
+        self.assertEqual(self.usernames('bert'), ['robert'])
+
+    def test_migration_indexes_existing_rows(self):
+        Post.objects.create(user=self.bob, description='#sunset')
+        SearchDocument.objects.all().delete()
+
+        import_module('base.migrations.0027_backfill_search_index').index_existing_rows(apps, None)
+        self.assertEqual(self.usernames('ann'), ['annabel', 'hannah', 'joanna'])
+        self.assertEqual(
+            list(search.search(SearchDocument.HASHTAG, 'sun').values_list('label', 'popularity')), [('sunset', 1)]
+        )
+
+    def test_hashtags_ranked_by_post_count(self):
+        Post.objects.create(user=self.bob, description='#sunset #sun')
+        Post.objects.create(user=self.bob, description='#sunset #sunday')
+        search.refresh_popularity()
+        hashtags = [document.label for document in search.search(SearchDocument.HASHTAG, 'sun')]
+        self.assertEqual(hashtags, ['sunset', 'sun', 'sunday'])
+        hashtags = [document.label for document in search.search(SearchDocument.HASHTAG, 'nda')]
+        self.assertEqual(hashtags, ['sunday'])
+
+        response = self.client.get(reverse('search'), {'text': 'sun', 'choice': 'hashtag'})
+        self.assertRegex(response.content.decode(), r'#sunset\s*</a>\s*\(2\)')
+
+
+class TrendingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+        cls.post = Post.objects.create(user=cls.author, description='Beach #sun #sea')
+
+    def trends(self):
+        return {trend.hashtag.name: trend.total_posts for trend in trending.top()}
+
+    def test_new_and_edited_tags_counted_once(self):
+        self.assertEqual(trending.update(), 2)
+        self.assertEqual(trending.update(), 0)
+
+        self.post.description = 'Beach #sun #sea #new'
+        self.post.save()
+        Post.objects.create(user=self.author, description='Noon #sun')
+        self.assertEqual(trending.update(), 2)
+        self.assertEqual(self.trends(), {'sun': 2, 'sea': 1, 'new': 1})
+
+    def test_scores_decay_when_read(self):
+        trending.update()
+        trend = HashtagTrend.objects.get(hashtag__name='sun')
+        self.assertAlmostEqual(trending.current_score(trend.score, self.post.created_at), 1)
+        later = self.post.created_at + timedelta(seconds=trending.HALF_LIFE)
+        self.assertAlmostEqual(trending.current_score(trend.score, later), 0.5)
+
+        # A run without new links writes nothing
+        with self.assertNumQueries(5):
+            self.assertEqual(trending.update(), 0)
+        self.assertEqual(HashtagTrend.objects.get(hashtag__name='sun').score, trend.score)
+
+    def test_recent_posts_rank_first(self):
+        old = Post.objects.create(user=self.author, description='#old #old2')
+        PostHashtag.objects.filter(post=old).update(created_at=timezone.now() - timedelta(days=30))
+        Post.objects.create(user=self.author, description='#new')
+        trending.update()
+
+        trend = HashtagTrend.objects.get(hashtag__name='sun')
+        Post.objects.create(user=self.author, description='#sun')
+        trending.update()
+        # One more post at the same age doubles the score
+        self.assertAlmostEqual(HashtagTrend.objects.get(hashtag__name='sun').score, trend.score + 1, places=3)
+        self.assertCountEqual([trend.hashtag.name for trend in trending.top()][-2:], ['old', 'old2'])
+
+    def test_full_rebuild_drops_removed_tags(self):
+        now = timezone.now()
+        with mock.patch('base.trending.timezone.now', return_value=now):
+            trending.update()
+        self.post.description = 'Beach #sun'
+        self.post.save()
+        with mock.patch('base.trending.timezone.now', return_value=now + timedelta(minutes=5)):
+            trending.update()
+        self.assertEqual(self.trends(), {'sun': 1, 'sea': 1})
+
+        later = now + timedelta(seconds=trending.FULL_REBUILD_INTERVAL)
+        with mock.patch('base.trending.timezone.now', return_value=later):
+            trending.update()
+        self.assertEqual(self.trends(), {'sun': 1})
+
+    def test_rebuild_in_batches(self):
+        Post.objects.create(user=self.author, description='Noon #sun #sky')
+        trending.update()
+        scores = dict(HashtagTrend.objects.values_list('hashtag__name', 'score'))
+
+        with mock.patch.object(trending, 'BATCH_SIZE', 1):
+            self.assertEqual(trending.update(full=True), 4)
+        self.assertEqual(self.trends(), {'sun': 2, 'sea': 1, 'sky': 1})
+        for name, score in HashtagTrend.objects.values_list('hashtag__name', 'score'):
+            self.assertAlmostEqual(score, scores[name])
+
+
+class SeedDataTests(TestCase):
+    def test_seed_data(self):
+        call_command('seed_data', users=30, hashtags=10, seed=1, batch_size=7, stdout=StringIO())
+
+        users = User.objects.filter(username__startswith='seed')
+        self.assertEqual(users.count(), 30)
+        self.assertFalse(users.filter(userprofile__isnull=True).exists())
+        self.assertTrue(Post.objects.exists())
+        self.assertTrue(Follow.objects.exists())
+        self.assertTrue(Notification.objects.exists())
+
+        # The dates are spread over the window, likes come after their post
+        dates = Post.objects.aggregate(first=Min('created_at'), last=Max('created_at'))
+        self.assertGreater(dates['last'] - dates['first'], timedelta(days=7))
+        self.assertFalse(PostLike.objects.filter(created_at__lt=F('post__created_at')).exists())
+        self.assertFalse(PostHashtag.objects.exclude(created_at=F('post__created_at')).exists())
+
+        # The derived counters were rebuilt, so recounting has nothing left to fix
+        out = StringIO()
+        call_command('recount_counters', stdout=out)
+        self.assertIn('Fixed counters on 0 posts.', out.getvalue())
+        self.assertIn('Fixed counters on 0 profiles.', out.getvalue())
+
+
+class PostCardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', None)
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+        cls.post = Post.objects.create(user=cls.author, image='post.jpg', description='Sunset #photo')
+
+    def setUp(self):
+        cache.clear()
+
+    def cached_body(self):
+        self.post.refresh_from_db()
+        key = make_template_fragment_key('post_card_body', [self.post.id, self.post.cache_version, 'author', ''])
+        return cache.get(key)
+
+    def test_shared_markup_cached_per_version(self):
+        self.client.get(reverse('index'))
+        self.assertIn('Comments: 0', self.cached_body())
+
+        self.post.add_like(self.viewer)
+        self.assertIsNone(self.cached_body())
+        self.assertContains(self.client.get(reverse('index')), '<span data-like-count>1<')
+
+        Comment.objects.create(post=self.post, user=self.viewer, text='Nice one')
+        self.assertIsNone(self.cached_body())
+        self.assertContains(self.client.get(reverse('index')), 'Comments: 1')
+
+        self.post.description = 'Sunrise #photo'
+        self.post.save()
+        self.assertContains(self.client.get(reverse('index')), 'Sunrise')
+
+    def test_cached_card_rendered_without_viewer_parts(self):
+        self.client.get(reverse('index'))
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('index'))
+        # The owner controls and the like form are rendered around the cached fragments
+        self.assertContains(response, reverse('post_update', args=[self.post.pk]))
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertNotIn('csrfmiddlewaretoken', self.cached_body())
+
+        # The details page lists the comments instead of linking to them
+        response = self.client.get(reverse('post_details', args=[self.post.pk]))
+        self.assertNotContains(response, f'href="{reverse("post_details", args=[self.post.pk])}"')
+
+    def test_like_state_per_viewer(self):
+        self.post.add_like(self.viewer)
+        self.client.force_login(self.viewer)
+        self.assertContains(self.client.get(reverse('index')), '<i class="bi bi-heart-fill')
+
+        self.client.force_login(self.author)
+        self.assertNotContains(self.client.get(reverse('index')), '<i class="bi bi-heart-fill')
+
+
+class DescriptionHtmlTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+
+    def test_render_description(self):
+        self.assertEqual(
+            Post.render_description('<b>Sunset</b> #photo & #żagle'),
+            '&lt;b&gt;Sunset&lt;/b&gt; <a href="/explore/tags/photo" class="text-decoration-none">#photo</a> &amp; '
+            '<a href="/explore/tags/%C5%BCagle" class="text-decoration-none">#żagle</a>',
+        )
+
+    def test_stored_on_save(self):
+        post = Post.objects.create(user=self.author, image='post.jpg', description='Sunset #photo')
+        self.assertIn('href="/explore/tags/photo"', post.description_html)
+
+        post.description = 'Sunrise #sky'
+        post.save(update_fields=['description'])
+        post.refresh_from_db()
+        self.assertIn('href="/explore/tags/sky"', post.description_html)
+
+    def test_render_descriptions_command(self):
+        post = Post.objects.create(user=self.author, image='post.jpg', description='Sunset #photo')
+        Post.objects.filter(pk=post.pk).update(description_html='')
+
+        call_command('render_descriptions', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.description_html, Post.render_description('Sunset #photo'))
+
+
+class ToggleEndpointTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', None)
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+        cls.post = Post.objects.create(user=cls.author, image='post.jpg', description='Sunset')
+
+    def setUp(self):
+        self.client.force_login(self.viewer)
+
+    def test_like_is_idempotent(self):
+        url = reverse('post_like', args=[self.post.pk])
+        for _ in range(2):
+            self.assertEqual(self.client.post(url).json(), {'liked': True, 'like_count': 1})
+        for _ in range(2):
+            self.assertEqual(self.client.delete(url).json(), {'liked': False, 'like_count': 0})
+        self.assertFalse(self.post.likes.exists())
+
+    def test_like_lost_race(self):
+        # Another request inserted the like between this one loading and saving
+        Post.likes.through.objects.create(post=self.post, user=self.viewer)
+        self.assertFalse(self.post.add_like(self.viewer))
+        self.assertEqual(Post.objects.get(pk=self.post.pk).like_count, 0)
+
+    def test_follow_is_idempotent(self):
+        url = reverse('user_follow', args=[self.author.username])
+        for _ in range(2):
+            self.assertEqual(self.client.post(url).json(), {'following': True, 'followers_count': 1})
+        self.assertEqual(NotificationEvent.objects.filter(verb=Notification.FOLLOW).count(), 1)
+        for _ in range(2):
+            self.assertEqual(self.client.delete(url).json(), {'following': False, 'followers_count': 0})
+        self.assertFalse(Follow.objects.exists())
+
+    def test_cannot_follow_yourself(self):
+        response = self.client.post(reverse('user_follow', args=[self.viewer.username]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_login_required(self):
+        self.client.logout()
+        self.assertEqual(self.client.post(reverse('post_like', args=[self.post.pk])).status_code, 403)
+        self.assertEqual(self.client.post(reverse('user_follow', args=[self.author.username])).status_code, 403)
+
+
+class NotificationCoalescingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+        cls.fans = [User.objects.create_user(f'fan{i}', f'fan{i}@example.com', None) for i in range(2)]
+        cls.post = Post.objects.create(user=cls.author, description='Sunset')
+
+    def notification(self):
+        return Notification.objects.get(recipient_user=self.author)
+
+    def unread_count(self):
+        return User.objects.select_related('userprofile').get(pk=self.author.pk).userprofile.unread_notifications_count
+
+    def test_events_merged_per_post(self):
+        for fan in self.fans:
+            self.post.add_like(fan)
+        self.post.add_like(self.author)
+        self.assertEqual(notifications.process_events(), 2)
+
+        notification = self.notification()
+        self.assertEqual((notification.verb, notification.action_user, notification.actor_count), ('like', self.fans[1], 2))
+        self.assertEqual(self.unread_count(), 1)
+        self.assertFalse(NotificationEvent.objects.exists())
+
+        notification.set_read(True)
+        self.post.remove_like(self.fans[0])
+        self.post.add_like(self.fans[0])
+        notifications.process_events()
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(self.unread_count(), 1)
+
+    def test_actors_counted_once(self):
+        for fan in (self.fans[0], self.fans[1], self.fans[0]):
+            self.post.remove_like(fan)
+            self.post.add_like(fan)
+            notifications.process_events()
+        self.assertEqual(self.notification().actor_count, 2)
+
+    def test_deleting_latest_comment_keeps_merged_notification(self):
+        for fan in self.fans:
+            Comment.objects.create(post=self.post, user=fan, text=f'By {fan.username}')
+        notifications.process_events()
+        latest = self.notification().action_comment
+        self.assertEqual(latest.text, 'By fan1')
+
+        latest.delete()
+        notification = self.notification()
+        self.assertEqual((notification.action_comment, notification.actor_count), (None, 2))
+        self.assertEqual(self.unread_count(), 1)
+
+    def test_deleting_comment_removes_its_notification(self):
+        comment = Comment.objects.create(post=self.post, user=self.fans[0], text='Nice')
+        notifications.process_events()
+        self.assertEqual(self.unread_count(), 1)
+
+        comment.delete()
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(self.unread_count(), 0)
+
+
+@override_settings(NOTIFICATION_BROKER={'BACKEND': 'base.broker.InProcessBroker'})
+class NotificationStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', None)
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+
+    def setUp(self):
+        broker.get_broker.cache_clear()
+        self.addCleanup(broker.get_broker.cache_clear)
+
+    def follow(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.author, following=self.viewer)
+            notifications.process_events()
+
+    async def test_process_events_publishes(self):
+        async with broker.get_broker().subscribe(notifications.channel(self.viewer.pk)) as queue:
+            await sync_to_async(self.follow)()
+            message = await asyncio.wait_for(queue.get(), 1)
+        self.assertEqual(message['unread_count'], 1)
+        self.assertEqual(message['notifications'][0]['actor'], 'author')
+
+    async def test_stream(self):
+        events = notifications.stream(self.viewer.pk)
+        self.assertEqual(await anext(events), 'retry: 30000\n')
+        self.assertIn('"unread_count": 0', await anext(events))
+
+        await sync_to_async(self.follow)()
+        self.assertIn('"unread_count": 1', await anext(events))
+        await events.aclose()
+
+    def test_view_outside_asgi(self):
+        self.client.force_login(self.viewer)
+        response = self.client.get(reverse('notification_stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn(b'event: notifications\ndata: {"unread_count": 0', response.content)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('notification_stream')).status_code, 403)
+
+    async def test_file_broker_fans_out_across_instances(self):
+        path = os.path.join(tempfile.mkdtemp(), 'events.jsonl')
+        subscriber = broker.FileBroker(path=path, poll_interval=0.01)
+        publisher = broker.FileBroker(path=path)
+        async with subscriber.subscribe('channel') as queue:
+            await asyncio.sleep(0.05)
+            publisher.publish('channel', {'unread_count': 3})
+            publisher.publish('other', {'unread_count': 4})
+            self.assertEqual(await asyncio.wait_for(queue.get(), 1), {'unread_count': 3})
+        self.assertEqual(subscriber.tails, {})
+
+    def test_file_broker_forgets_loops_outside_asgi(self):
+        path = os.path.join(tempfile.mkdtemp(), 'events.jsonl')
+        self.enterContext(override_settings(NOTIFICATION_BROKER={
+            'BACKEND': 'base.broker.FileBroker', 'OPTIONS': {'path': path},
+        }))
+        self.client.force_login(self.viewer)
+        # Every request runs the stream on an event loop of its own
+        for i in range(3):
+            self.assertEqual(self.client.get(reverse('notification_stream')).status_code, 200)
+        self.assertEqual(broker.get_broker().tails, {})
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = db.PrimaryReplicaRouter(replicas=['replica1', 'replica2'])
+        self.factory = RequestFactory()
+
+    def handle(self, request, view):
+        """Run ``view`` inside the middleware, returning its result and the response."""
+        result = {}
+
+        def get_response(request):
+            result['value'] = view()
+            return HttpResponse()
+
+        response = db.ReplicaRoutingMiddleware(get_response)(request)
+        return result['value'], response
+
+    def test_reads_outside_requests_use_the_primary(self):
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_safe_request_reads_from_replicas(self):
+        databases, response = self.handle(self.factory.get('/'), lambda: {
+            self.router.db_for_read(Post) for _ in range(20)
+        })
+        self.assertEqual(databases, {'replica1', 'replica2'})
+        self.assertNotIn(db.PIN_COOKIE, response.cookies)
+
+    def test_request_reads_its_own_writes(self):
+        def view():
+            before = self.router.db_for_read(Post)
+            self.router.db_for_write(Post)
+            return before, self.router.db_for_read(Post)
+
+        databases, response = self.handle(self.factory.get('/'), view)
+        self.assertIn(databases[0], ['replica1', 'replica2'])
+        self.assertEqual(databases[1], 'default')
+        self.assertEqual(response.cookies[db.PIN_COOKIE]['max-age'], db.PIN_SECONDS)
+
+    def test_pinned_client_and_unsafe_requests_use_the_primary(self):
+        request = self.factory.get('/')
+        request.COOKIES[db.PIN_COOKIE] = '1'
+        self.assertEqual(self.handle(request, lambda: self.router.db_for_read(Post))[0], 'default')
+        self.assertEqual(self.handle(self.factory.post('/'), lambda: self.router.db_for_read(Post))[0], 'default')
+
+    def test_replicas_are_not_migrated(self):
+        self.assertTrue(self.router.allow_migrate('default', 'base'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'base'))
+
+
+class SQLiteTuningTests(TestCase):
+    def test_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            # The lock wait comes from the driver timeout alone, no pragma overrides it
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.DATABASES['default']['OPTIONS']['timeout'] * 1000)
+
+
+def make_image(color='red', size=(32, 32)):
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@mock.patch('base.images.schedule')
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.user = User.objects.create_user('author', 'author@example.com', None)
+        self.client.force_login(self.user)
+
+    def upload(self, data, filename='photo.png'):
+        response = self.client.post(reverse('post_add'), {
+            'image': SimpleUploadedFile(filename, data, 'image/png'), 'description': 'Upload',
+        })
+        self.assertEqual(response.status_code, 302)
+        return Post.objects.filter(user=self.user).latest('created_at')
+
+    def test_duplicate_uploads_share_one_file(self, schedule):
+        data = make_image()
+        digest = hashlib.sha256(data).hexdigest()
+        first = self.upload(data)
+        second = self.upload(data, 'copy.PNG')
+
+        self.assertEqual(first.image.name, f'cas/{digest[:2]}/{digest[2:4]}/{digest}.png')
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(MediaBlob.objects.get().ref_count, 2)
+        self.assertEqual(os.listdir(os.path.dirname(first.image.path)), [f'{digest}.png'])
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
+    def test_large_uploads_are_hashed_while_streamed(self, schedule):
+        data = make_image('blue')
+        with mock.patch.object(storage.ContentAddressedStorage, 'hash') as rehash:
+            post = self.upload(data)
+        rehash.assert_not_called()
+        self.assertIn(hashlib.sha256(data).hexdigest(), post.image.name)
+
+    def test_last_reference_removes_file_and_derivatives(self, schedule):
+        first = self.upload(make_image())
+        second = self.upload(make_image())
+        name = first.image.name
+        derivative = default_storage.save(f'derivatives/{name[:-4]}/grid.webp', SimpleUploadedFile('grid.webp', b'x'))
+
+        default_storage.delete(name)
+        self.assertTrue(default_storage.exists(name))
+        default_storage.delete(second.image.name)
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(default_storage.exists(derivative))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_replacing_image_releases_previous_blob(self, schedule):
+        post = self.upload(make_image())
+        previous = post.image.name
+        post.image = SimpleUploadedFile('new.png', make_image('green'))
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+        self.assertFalse(default_storage.exists(previous))
+        self.assertEqual(list(MediaBlob.objects.values_list('name', flat=True)), [post.image.name])
+
+    def test_immutable_cache_headers(self, schedule):
+        post = self.upload(make_image())
+        request = RequestFactory().get(post.image.url)
+        response = storage.serve(request, post.image.name, default_storage.location)
+        self.assertEqual(response['Cache-Control'], storage.IMMUTABLE_CACHE_CONTROL)
+
+        with open(os.path.join(default_storage.location, 'legacy.png'), 'wb') as legacy:
+            legacy.write(make_image())
+        response = storage.serve(request, 'legacy.png', default_storage.location)
+        self.assertNotIn('Cache-Control', response)
+
+    def test_deleting_post_releases_image(self, schedule):
+        post = self.upload(make_image())
+        name = post.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('post_delete', args=[post.pk]))
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_gc_media_removes_unreferenced_files(self, schedule):
+        kept = self.upload(make_image())
+        orphan = self.upload(make_image('green'))
+        orphan_name = orphan.image.name
+        derivative = default_storage.save(
+            f'derivatives/{orphan_name[:-4]}/grid.webp', SimpleUploadedFile('grid.webp', b'x')
+        )
+        Post.objects.filter(pk=orphan.pk).delete()
+
+        call_command('gc_media', stdout=StringIO())
+        self.assertTrue(default_storage.exists(orphan_name))
+
+        call_command('gc_media', '--min-age', '-60', stdout=StringIO())
+        self.assertFalse(default_storage.exists(orphan_name))
+        self.assertFalse(default_storage.exists(derivative))
+        self.assertTrue(default_storage.exists(kept.image.name))
+        self.assertEqual(list(MediaBlob.objects.values_list('name', flat=True)), [kept.image.name])
+
+
+@mock.patch('base.images.schedule')
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.user = User.objects.create_user('author', 'author@example.com', None)
+
+    def create_post(self, size):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Post.objects.create(
+                user=self.user, description='Upload', image=SimpleUploadedFile('photo.png', make_image(size=size)),
+            )
+
+    def test_upload_schedules_derivatives(self, schedule):
+        post = self.create_post((32, 32))
+        schedule.assert_called_once_with(images.generate_post_derivatives, post.pk)
+
+    def test_sizes_rendered_and_stored(self, schedule):
+        post = self.create_post((1200, 800))
+        images.generate_post_derivatives(post.pk)
+        post.refresh_from_db()
+
+        self.assertEqual(set(post.image_variants), set(images.POST_IMAGE_SIZES))
+        self.assertEqual(post.image_variants['grid'], {
+            'name': images.derivative_name(post.image.name, 'grid'), 'width': 600, 'height': 600,
+        })
+        # Fitted within the bounds without upscaling
+        self.assertEqual((post.image_variants['feed']['width'], post.image_variants['feed']['height']), (1080, 720))
+        self.assertEqual((post.image_variants['full']['width'], post.image_variants['full']['height']), (1200, 800))
+        for variant in post.image_variants.values():
+            self.assertTrue(default_storage.exists(variant['name']))
+        self.assertEqual(post.image_grid_url, default_storage.url(post.image_variants['grid']['name']))
+
+        # Running the job again replaces the files instead of adding suffixed copies
+        images.generate_post_derivatives(post.pk)
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants['grid']['name'], images.derivative_name(post.image.name, 'grid'))
+
+    def test_image_replaced_while_rendering(self, schedule):
+        post = self.create_post((64, 64))
+        render = images.generate_derivatives
+
+        def replace_image(*args):
+            variants = render(*args)
+            Post.objects.filter(pk=post.pk).update(image='cas/00/00/replaced.png')
+            return variants
+
+        with mock.patch.object(images, 'generate_derivatives', replace_image):
+            images.generate_post_derivatives(post.pk)
+        # The variants of the previous image are not written over the new one
+        self.assertEqual(Post.objects.get(pk=post.pk).image_variants, {})
+
+
+class AccountDeletionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.leaving = User.objects.create_user('leaving', 'leaving@example.com', None)
+        cls.fan = User.objects.create_user('fan', 'fan@example.com', None)
+        cls.friend = User.objects.create_user('friend', 'friend@example.com', None)
+        Follow.objects.create(follower=cls.fan, following=cls.leaving)
+        Follow.objects.create(follower=cls.leaving, following=cls.friend)
+
+        own_post = Post.objects.create(user=cls.leaving, description='Leaving #soon')
+        own_post.add_like(cls.fan)
+        Comment.objects.create(post=own_post, user=cls.fan, text='Why?')
+
+        cls.fan_post = Post.objects.create(user=cls.fan, description='Staying')
+        cls.fan_post.add_like(cls.leaving)
+        comment = Comment.objects.create(post=cls.fan_post, user=cls.leaving, text='Bye')
+        comment.likes.add(cls.fan)
+        Comment.objects.get(text='Why?').likes.add(cls.leaving)
+        notifications.process_events()
+
+    def profile(self, user):
+        return User.objects.select_related('userprofile').get(pk=user.pk).userprofile
+
+    def test_deleted_in_chunks_with_counters_kept(self):
+        self.assertEqual(self.profile(self.fan).unread_notifications_count, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('delete_accounts', 'leaving', '--once', '--batch-size', '1', stdout=StringIO())
+
+        self.assertFalse(User.objects.filter(username='leaving').exists())
+        self.assertFalse(Post.objects.exclude(user=self.fan).exists())
+        self.assertEqual(list(Comment.objects.all()), [])
+        self.assertFalse(NotificationEvent.objects.exists())
+        fan_post = Post.objects.get(pk=self.fan_post.pk)
+        self.assertEqual((fan_post.like_count, fan_post.comment_count), (0, 0))
+        fan, friend = self.profile(self.fan), self.profile(self.friend)
+        self.assertEqual((fan.following_count, fan.unread_notifications_count), (0, 0))
+        self.assertEqual((friend.followers_count, friend.unread_notifications_count), (0, 0))
+
+    def test_resumes_after_failure(self):
+        deletion.request_account_deletion(self.leaving)
+        self.assertFalse(User.objects.get(pk=self.leaving.pk).is_active)
+
+        with mock.patch.dict(deletion.STEPS, {'comments': mock.Mock(side_effect=RuntimeError)}):
+            with self.assertRaises(RuntimeError):
+                while deletion.process(batch_size=1) is not None:
+                    pass
+        self.assertEqual(AccountDeletion.objects.get().step, 'likes')
+        self.assertTrue(Comment.objects.filter(user=self.leaving).exists())
+
+        while deletion.process(batch_size=1) is not None:
+            pass
+        self.assertFalse(User.objects.filter(username='leaving').exists())
+        self.assertFalse(AccountDeletion.objects.exists())
@@ -0,0 +1,92 @@
+"""
+Materialized followed-posts timeline.
+
+New posts are pushed (fanned out) into a TimelineEntry row for every follower of their
+author, so reading the followed feed is an indexed range scan on ``(user, created_at)``.
+Authors with more than ``TIMELINE_FANOUT_LIMIT`` followers are skipped on write and
+their posts are merged into the page at read time instead.
+"""
+from django.conf import settings
+
+from . import models
+from .pagination import KeysetPage, KeysetPaginator
+
+FANOUT_LIMIT = getattr(settings, 'TIMELINE_FANOUT_LIMIT', 5000)
+BACKFILL_SIZE = getattr(settings, 'TIMELINE_BACKFILL_SIZE', 100)
+BATCH_SIZE = 1000
+
+
+def is_fanned_out(user_id):
+    """Whether posts of the given author are pushed into their followers' timelines."""
+    followers_count = models.UserProfile.objects.filter(user_id=user_id).values_list('followers_count', flat=True)
+    return (followers_count.first() or 0) <= FANOUT_LIMIT
+
+
+def fan_out_post(post):
+    if not is_fanned_out(post.user_id):
+        return
+
+    followers = models.Follow.objects.filter(following_id=post.user_id).values_list('follower_id', flat=True)
+    entries = (
+        models.TimelineEntry(user_id=follower_id, post_id=post.pk, created_at=post.created_at)
+        for follower_id in followers.iterator(chunk_size=BATCH_SIZE)
+    )
+    models.TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def backfill(follower_id, following_id):
+    """Copy the most recent posts of a newly followed author into the follower's timeline."""
+    if not is_fanned_out(following_id):
+        return
+
+    posts = models.Post.objects.filter(user_id=following_id).order_by('-created_at').values_list('id', 'created_at')
+    entries = [
+        models.TimelineEntry(user_id=follower_id, post_id=post_id, created_at=created_at)
+        for post_id, created_at in posts[:BACKFILL_SIZE]
+    ]
+    models.TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def trim(follower_id, following_id):
+    """Remove the posts of an unfollowed author from the follower's timeline."""
+    models.TimelineEntry.objects.filter(user_id=follower_id, post__user_id=following_id).delete()
+
+
+def get_page(user, queryset, per_page, cursor=None):
+    """
+    Return a KeysetPage of posts from ``queryset`` for the followed feed of ``user``.
+
+    Cursors are compatible with a ``('-created_at', '-id')`` KeysetPaginator over ``queryset``.
+    Raises InvalidCursor for malformed cursors.
+    """
+    paginator = KeysetPaginator(queryset, per_page)
+    values = paginator.decode_cursor(cursor) if cursor else None
+
+    entries = models.TimelineEntry.objects.filter(user=user)
+    entries_paginator = KeysetPaginator(entries, per_page, ('-created_at', '-post_id'))
+    if values:
+        entries = entries.filter(entries_paginator.get_keyset_filter(values))
+    entries = entries.order_by(*entries_paginator.ordering)
+    candidates = list(entries.values_list('created_at', 'post_id')[:per_page + 1])
+
+    # Authors too popular for fan-out on write are merged at read time
+    merged_authors = list(models.Follow.objects.filter(
+        follower=user,
+        following__userprofile__followers_count__gt=FANOUT_LIMIT,
+    ).values_list('following_id', flat=True))
+    if merged_authors:
+        posts = models.Post.objects.filter(user_id__in=merged_authors).order_by('-created_at', '-id')
+        if values:
+            posts = posts.filter(paginator.get_keyset_filter(values))
+        candidates = sorted(
+            set(candidates) | set(posts.values_list('created_at', 'id')[:per_page + 1]),
+            reverse=True,
+        )
+
+    has_next = len(candidates) > per_page
+    post_ids = [post_id for created_at, post_id in candidates[:per_page]]
+    posts_by_id = queryset.in_bulk(post_ids)
+    object_list = [posts_by_id[post_id] for post_id in post_ids if post_id in posts_by_id]
+
+    next_cursor = paginator.encode_cursor(object_list[-1]) if has_next and object_list else None
+    return KeysetPage(object_list, next_cursor)
@@ -0,0 +1,153 @@
+"""
+Time-decayed trending hashtags.
+
+HashtagTrend keeps a total post count and a score per tag, where every post counts
+``0.5 ** (age / half life)``. As every score decays at the same rate, the stored score
+is relative to the fixed EPOCH instead of to the current time: it is the log2 of the sum
+of ``2 ** ((created_at - EPOCH) / half life)`` over the posts, so the ranking does not
+change between runs and the decay is applied when a score is read. Each run adds the
+post/hashtag links inserted since the previous one, found by their id, and only touches
+the tags that gained links: the work done is proportional to the new links, and serving
+the top tags is a single index scan. Tags added by editing an older post count from the
+next run, with the age of the post.
+
+Removed tags and deleted posts are not subtracted. Instead the trends are recomputed
+from all links every TRENDING_FULL_REBUILD_HOURS, which also picks up a link committed
+after a link with a higher id was already counted. The rebuild reads the links and
+writes the trends in batches, each committed on its own, so it does not hold the write
+lock for its whole run; the trends are replaced tag by tag and stay readable meanwhile.
+"""
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import models
+
+CHECKPOINT = 'trending_hashtags'
+FULL_REBUILD_CHECKPOINT = 'trending_hashtags_full'
+HALF_LIFE = getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 24) * 3600
+FULL_REBUILD_INTERVAL = getattr(settings, 'TRENDING_FULL_REBUILD_HOURS', 24) * 3600
+EPOCH = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+BATCH_SIZE = 1000
+
+
+def epoch_score(created_at):
+    """Stored score of a single post created at ``created_at``."""
+    return (created_at - EPOCH).total_seconds() / HALF_LIFE
+
+
+def add_scores(first, second):
+    """Stored score of the posts of two stored scores, log2(2 ** first + 2 ** second) without overflowing."""
+    if first is None:
+        return second
+    high, low = max(first, second), min(first, second)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def current_score(score, now=None):
+    """Decayed number of posts of a stored ``score`` at ``now``."""
+    now = now or timezone.now()
+    return 2 ** (score - epoch_score(now))
+
+
+def update(full=False):
+    """Fold the links inserted since the last run into the trends. Returns the number of tagged posts added."""
+    now = timezone.now()
+    count = 0
+    rebuilt, created = models.JobCheckpoint.objects.get_or_create(name=FULL_REBUILD_CHECKPOINT)
+    if full or not rebuilt.position or (now - rebuilt.position).total_seconds() >= FULL_REBUILD_INTERVAL:
+        count = rebuild()
+        rebuilt.position = now
+        rebuilt.save()
+
+    with transaction.atomic():
+        checkpoint, created = models.JobCheckpoint.objects.select_for_update().get_or_create(name=CHECKPOINT)
+        tagged = models.PostHashtag.objects.order_by('id')
+        if checkpoint.last_id is not None:
+            tagged = tagged.filter(id__gt=checkpoint.last_id)
+        last_id = checkpoint.last_id
+        totals = {}
+        scores = {}
+        rows = tagged.values_list('id', 'hashtag_id', 'created_at').iterator(chunk_size=BATCH_SIZE)
+        for last_id, hashtag_id, created_at in rows:
+            totals[hashtag_id] = totals.get(hashtag_id, 0) + 1
+            scores[hashtag_id] = add_scores(scores.get(hashtag_id), epoch_score(created_at))
+            count += 1
+        if not totals:
+            return count
+
+        trends = models.HashtagTrend.objects.in_bulk(list(totals))
+        for hashtag_id, trend in trends.items():
+            trend.total_posts += totals[hashtag_id]
+            trend.score = add_scores(trend.score, scores[hashtag_id])
+        models.HashtagTrend.objects.bulk_update(trends.values(), ['total_posts', 'score'], batch_size=BATCH_SIZE)
+        models.HashtagTrend.objects.bulk_create(
+            [
+                models.HashtagTrend(hashtag_id=hashtag_id, total_posts=total, score=scores[hashtag_id])
+                for hashtag_id, total in totals.items() if hashtag_id not in trends
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+        checkpoint.position = now
+        checkpoint.last_id = last_id
+        checkpoint.save()
+    return count
+
+
+def rebuild():
+    """Recompute the trends from all links, in batches committed one by one. Returns the number of links."""
+    last_id = models.PostHashtag.objects.order_by('-id').values_list('id', flat=True).first()
+
+    # Reading the links takes a short read per batch
+    totals = {}
+    scores = {}
+    position = 0
+    while last_id is not None and position < last_id:
+        rows = list(
+            models.PostHashtag.objects.filter(id__gt=position, id__lte=last_id).order_by('id')
+            .values_list('id', 'hashtag_id', 'created_at')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        for position, hashtag_id, created_at in rows:
+            totals[hashtag_id] = totals.get(hashtag_id, 0) + 1
+            scores[hashtag_id] = add_scores(scores.get(hashtag_id), epoch_score(created_at))
+
+    hashtag_ids = sorted(totals)
+    for start in range(0, len(hashtag_ids), BATCH_SIZE):
+        with transaction.atomic():
+            batch = hashtag_ids[start:start + BATCH_SIZE]
+            trends = models.HashtagTrend.objects.in_bulk(batch)
+            for hashtag_id, trend in trends.items():
+                trend.total_posts = totals[hashtag_id]
+                trend.score = scores[hashtag_id]
+            models.HashtagTrend.objects.bulk_update(trends.values(), ['total_posts', 'score'])
+            models.HashtagTrend.objects.bulk_create([
+                models.HashtagTrend(hashtag_id=hashtag_id, total_posts=totals[hashtag_id], score=scores[hashtag_id])
+                for hashtag_id in batch if hashtag_id not in trends
+            ])
+
+    # Tags without any link left
+    position = 0
+    while True:
+        batch = list(
+            models.HashtagTrend.objects.filter(hashtag_id__gt=position).order_by('hashtag_id')
+            .values_list('hashtag_id', flat=True)[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        models.HashtagTrend.objects.filter(hashtag_id__in=[pk for pk in batch if pk not in totals]).delete()
+        position = batch[-1]
+
+    # The links up to last_id are counted, the next incremental pass starts after them
+    models.JobCheckpoint.objects.update_or_create(name=CHECKPOINT, defaults={'last_id': last_id})
+    return sum(totals.values())
+
+
+def top(limit=None):
+    limit = limit or getattr(settings, 'TRENDING_HASHTAGS_LIMIT', 30)
+    return models.HashtagTrend.objects.select_related('hashtag').order_by('-score')[:limit]
@@ -4,16 +4,20 @@ from . import views
 urlpatterns = [
     path('', views.AllPostsListView.as_view(), name='index'),
     path('s/index', views.SearchView.as_view(), name='search'),
+    path('internal/metrics', views.MetricsView.as_view(), name='metrics'),
 
     path('<str:username>', views.PostUserGridView.as_view(), name='post_user_grid'),
     path('<str:username>/followers', views.UserFollowersView.as_view(), name='user_followers'),
     path('<str:username>/following', views.UserFollowingView.as_view(), name='user_following'),
+    path('<str:username>/follow', views.UserFollowView.as_view(), name='user_follow'),
     path('profile/edit', views.UserProfileEditView.as_view(), name='user_profile_edit'),
     path('notifications/', views.NotificationListView.as_view(), name='notifications'),
+    path('notifications/stream', views.NotificationStreamView.as_view(), name='notification_stream'),
 
     path('post/add/', views.PostAddView.as_view(), name='post_add'),
     path('post/<uuid:pk>/', views.PostDetailView.as_view(), name='post_details'),
     path('post/<uuid:pk>/likes', views.PostLikesView.as_view(), name='post_likes'),
+    path('post/<uuid:pk>/like', views.PostLikeView.as_view(), name='post_like'),
     path('posts/followed/', views.AllPostsFollowedListView.as_view(), name='posts_followed'),
 
     path('post/<uuid:pk>/update', views.PostUpdateView.as_view(), name='post_update'),
@@ -22,5 +26,6 @@ urlpatterns = [
     path('comment/<int:pk>/update/', views.CommentUpdateView.as_view(), name='comment_update'),
     path('comment/<int:pk>/delete/', views.CommentDeleteView.as_view(), name='comment_delete'),
 
+    path('explore/', views.ExploreView.as_view(), name='explore'),
     path('explore/tags/<str:hashtag>', views.HashtagPostListView.as_view(), name='explore_hashtag'),
 ]
\ No newline at end of file
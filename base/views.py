@@ -1,43 +1,86 @@
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Q, Value, Count, CharField, F
-from django.db.models.functions import Replace
-from django.http import HttpResponseRedirect
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db.models import Value, Count, CharField, F, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Lower, Replace
+from django.http import HttpResponse, HttpResponseRedirect, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy, reverse
 from django.views import View
-from django.views.generic import CreateView, UpdateView, ListView, DeleteView, DetailView, FormView, TemplateView
+from django.views.generic import CreateView, UpdateView, ListView, DeleteView, FormView, TemplateView
 import re
 
 from .forms import CommentForm, UserProfileEditForm, SearchForm
-from .models import User, UserProfile, Hashtag, Post, Comment, Follow, Notification
+from .models import User, UserProfile, Hashtag, Post, PostHashtag, PostLike, Comment, Follow, Notification, SearchDocument
+from .conditional import ConditionalGetMixin
+from .pagination import InvalidCursor, KeysetPage, KeysetPaginationMixin, KeysetPaginator
+from . import metrics, notifications, search, timeline, trending
 
 
-class AllPostsListView(ListView):
+class AllPostsListView(ConditionalGetMixin, KeysetPaginationMixin, ListView):
     """View for displaying a list of all posts."""
     template_name = 'post_list.html'
     model = Post
     context_object_name = 'posts'
+    page = None
 
-    def get_context_data(self, *, object_list=None, **kwargs):
-        posts = self.get_queryset()
+    def get_queryset(self):
+        queryset = Post.objects.select_related('user__userprofile')
+        return queryset
+
+    def get_etag_parts(self):
+        # The page is validated by the versions and counters of its posts, and kept to render it
+        self.object_list = self.get_queryset()
+        self.page = self.get_page()
+        return [self.page.next_cursor, [(post.id, post.updated_at, post.like_count, post.comment_count) for post in self.page]]
+
+    def get_liked_ids(self, posts):
+        if not self.request.user.is_authenticated:
+            return set()
+        return set(PostLike.objects.filter(
+            user_id=self.request.user.id,
+            post_id__in=[post.id for post in posts]
+        ).values_list('post_id', flat=True))
+
+    def get_posts_data(self, posts):
+        liked_ids = self.get_liked_ids(posts)
+        followed_likers = PostLike.followed_likers(self.request.user, [post.id for post in posts])
 
         posts_data = []
         for post in posts:
+            likers = followed_likers.get(post.id, [])
             data = {
                 'id': post.id,
-                'image_url': post.image_url,
+                'image_url': post.image_feed_url,
+                'image_srcset': post.image_srcset,
                 'description': post.description,
+                'description_html': post.description_html,
                 'user': post.user,
-                'avatar_image': post.user.userprofile.avatar_url,
-                'total_likes': post.total_likes,
-                'total_comments': post.total_comments,
+                'avatar_image': post.user.userprofile.avatar_small_url,
+                'total_likes': post.like_count,
+                'total_comments': post.comment_count,
                 'created_at': post.created_at,
-                'is_liked': True if post.likes.filter(id=self.request.user.id).exists() else False
+                'cache_version': post.cache_version,
+                'is_liked': post.id in liked_ids,
+                'followed_likers': likers,
+                'other_likes_count': max(post.like_count - len(likers), 0),
             }
             posts_data.append(data)
+        return posts_data
+
+    def get_page(self):
+        return self.paginate_keyset(self.object_list)
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        page = self.page if self.page is not None else self.get_page()
 
         context = {
-            'posts': posts_data,
+            'posts': self.get_posts_data(page.object_list),
+            'next_cursor': page.next_cursor,
         }
         return context
 
@@ -45,24 +88,27 @@ class AllPostsListView(ListView):
         # Like post
         post_like_id = request.POST.get("post_like_id")
         if post_like_id and self.request.user.is_authenticated:
-            post = Post.objects.get(id=post_like_id)
-            if post.likes.filter(id=request.user.id).exists():
-                post.likes.remove(request.user)
-            else:
-                post.likes.add(request.user)
+            post = get_object_or_404(Post, id=post_like_id)
+            if not post.remove_like(request.user):
+                post.add_like(request.user)
         elif post_like_id:
             return redirect(reverse('account_login'))
-        return HttpResponseRedirect(request.path_info)
+        return HttpResponseRedirect(request.get_full_path())
 
 
 class AllPostsFollowedListView(LoginRequiredMixin, AllPostsListView):
     template_name = 'post_list_followed.html'
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        followed_users = Follow.objects.filter(follower=self.request.user).values('following')
-        followed_posts = queryset.filter(user__in=followed_users).distinct()
-        return followed_posts
+    def get_etag_parts(self):
+        # Validating the merged timeline would cost as much as reading it
+        return None
+
+    def get_page(self):
+        cursor = self.request.GET.get(self.cursor_kwarg)
+        try:
+            return timeline.get_page(self.request.user, self.object_list, self.paginate_by, cursor)
+        except InvalidCursor:
+            raise Http404('Invalid page cursor.')
 
 
 class PostAddView(LoginRequiredMixin, CreateView):
@@ -95,30 +141,74 @@ class PostDeleteView(LoginRequiredMixin, DeleteView):
 class PostDetailView(AllPostsListView):
     """View for displaying the details of a specific post."""
     template_name = 'post_details.html'
+    object = None
+    comments_per_page = 20
+    # order: keyset ordering of the comments
+    COMMENT_ORDERINGS = {
+        'oldest': ('created_at', 'id'),
+        'newest': ('-created_at', '-id'),
+    }
+
+    def get_etag_parts(self):
+        # Comment changes bump the post's updated_at
+        self.object = self.get_queryset().first()
+        if self.object is None:
+            return None
+        return [self.object.updated_at, self.object.like_count, self.object.comment_count]
+
+    def get_last_modified(self):
+        return self.object.updated_at
 
     def get_queryset(self):
-        uuid = self.kwargs.get('pk')
-        queryset = Post.objects.filter(id=uuid)
+        queryset = super().get_queryset().filter(id=self.kwargs.get('pk'))
+        user = self.request.user
+        if user.is_authenticated:
+            queryset = queryset.annotate(is_liked=Exists(PostLike.objects.filter(post=OuterRef('pk'), user=user)))
         return queryset
 
+    def get_liked_ids(self, posts):
+        return {post.id for post in posts if getattr(post, 'is_liked', False)}
+
+    def get_comments_page(self, post_id):
+        order = self.request.GET.get('order')
+        if order not in self.COMMENT_ORDERINGS:
+            order = 'oldest'
+        like_count = Comment.likes.through.objects.filter(comment_id=OuterRef('pk')).order_by().values(
+            'comment_id'
+        ).annotate(count=Count('*')).values('count')
+        comments = Comment.objects.filter(post_id=post_id).select_related('user__userprofile').only(
+            'id', 'text', 'created_at', 'post_id',
+            'user__username', 'user__userprofile__avatar', 'user__userprofile__avatar_variants',
+        ).annotate(like_count=Coalesce(Subquery(like_count), 0))
+
+        paginator = KeysetPaginator(comments, self.comments_per_page, self.COMMENT_ORDERINGS[order])
+        try:
+            return order, paginator.get_page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404('Invalid page cursor.')
+
     def get_context_data(self, *, object_list=None, **kwargs):
-        context = super().get_context_data(object_list=None, **kwargs)
-        posts = context['posts']
-        post = posts[0]
-        context['post'] = post
-        context['comments_enabled'] = True
-        post_object = get_object_or_404(self.get_queryset())
-        comments = Comment.objects.filter(post=post_object)
-        context['comments'] = comments
-        context['form'] = CommentForm
+        post = self.object
+        if post is None:
+            raise Http404('No post found matching the query')
+        post_data = self.get_posts_data([post])[0]
+        order, comments = self.get_comments_page(post.id)
+
+        context = {
+            'post': post_data,
+            'comments_enabled': True,
+            'comments': comments.object_list,
+            'comments_order': order,
+            'next_cursor': comments.next_cursor,
+            'form': CommentForm,
+        }
         return context
 
     def post(self, request, *args, **kwargs):
         pk = self.kwargs.get('pk')
-        post = get_object_or_404(self.get_queryset())
-
         form = CommentForm(request.POST)
         if form.is_valid() and self.request.user.is_authenticated:
+            post = get_object_or_404(Post.objects.only('id', 'user_id'), pk=pk)
             text = form.cleaned_data['text']
             comment = Comment(user=self.request.user, post=post, text=text)
             comment.save()
@@ -152,51 +242,115 @@ class CommentDeleteView(DeleteView):
         return redirect_url
 
 
-class PostUserGridView(ListView):
+class PostUserGridView(ConditionalGetMixin, KeysetPaginationMixin, ListView):
     """View for displaying posts of a specific user."""
     template_name = 'post_user_grid.html'
+    paginate_by = 24
+    profile_owner = None
 
-    def get_queryset(self):
+    def get_profile_owner(self):
         username = self.kwargs.get('username')
-        queryset = get_object_or_404(User, username=username)
+        return get_object_or_404(User.objects.select_related('userprofile'), username=username)
+
+    def get_etag_parts(self):
+        # The page is validated by the profile counters and the posts it shows, and kept to render it
+        self.object_list = self.get_queryset()
+        self.page = self.paginate_keyset(self.object_list)
+        profile = self.profile_owner.userprofile
+        return [
+            self.profile_owner.pk, profile.posts_count, profile.followers_count, profile.following_count,
+            self.page.next_cursor, [(post.id, post.updated_at, post.like_count, post.comment_count) for post in self.page],
+        ]
+
+    def get_queryset(self):
+        if self.profile_owner is None:
+            self.profile_owner = self.get_profile_owner()
+        queryset = Post.objects.filter(user=self.profile_owner).only(
+            'id', 'image', 'image_variants', 'description', 'created_at', 'updated_at', 'like_count', 'comment_count'
+        )
         return queryset
 
     def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        profile_owner = self.get_queryset()
-        posts = Post.objects.filter(user=profile_owner)
-        context['posts'] = posts
-        context['posts_count'] = posts.count()
-        context['profile_owner'] = profile_owner
-
-        avatar = profile_owner.userprofile.avatar_url
-        context['avatar'] = avatar
+        profile_owner = self.profile_owner
+        profile = profile_owner.userprofile
+        page = self.page
 
-        followers = Follow.objects.filter(following=profile_owner).count()
-        context['followers'] = followers
-
-        following = Follow.objects.filter(follower=profile_owner).count()
-        context['following'] = following
+        context = {
+            'posts': page.object_list,
+            'next_cursor': page.next_cursor,
+            'posts_count': profile.posts_count,
+            'profile_owner': profile_owner,
+            'avatar': profile.avatar_medium_url,
+            'followers': profile.followers_count,
+            'following': profile.following_count,
+        }
 
-        if profile_owner != self.request.user:
-            if Follow.objects.filter(follower=self.request.user, following=profile_owner).exists():
+        user = self.request.user
+        if user.is_authenticated and profile_owner != user:
+            if Follow.objects.filter(follower=user, following=profile_owner).exists():
                 context['is_followed'] = True
 
         return context
 
     def post(self, request, *args, **kwargs):
         username = kwargs.get('username')
+        if not request.user.is_authenticated:
+            return redirect(reverse('account_login'))
         followed_user = get_object_or_404(User, username=username)
-        relation = Follow.objects.filter(follower=self.request.user, following=followed_user)
-        if relation.exists():
-            relation.delete()
-        else:
-            follow = Follow(follower=self.request.user, following=followed_user)
-            follow.save()
+        if followed_user != request.user and not Follow.unfollow(request.user, followed_user):
+            Follow.follow(request.user, followed_user)
         redirect_url = reverse('post_user_grid', kwargs={'username': username})
         return redirect(redirect_url)
 
 
+class PostLikeView(LoginRequiredMixin, View):
+    """View for liking (POST) and unliking (DELETE) a post, answering with the new state."""
+    raise_exception = True
+
+    def post(self, request, *args, **kwargs):
+        post = get_object_or_404(Post.objects.only('id', 'user_id'), pk=kwargs['pk'])
+        post.add_like(request.user)
+        return self.get_response(post, True)
+
+    def delete(self, request, *args, **kwargs):
+        post = get_object_or_404(Post.objects.only('id', 'user_id'), pk=kwargs['pk'])
+        post.remove_like(request.user)
+        return self.get_response(post, False)
+
+    @staticmethod
+    def get_response(post, liked):
+        like_count = Post.objects.filter(pk=post.pk).values_list('like_count', flat=True).first()
+        return JsonResponse({'liked': liked, 'like_count': like_count})
+
+
+class UserFollowView(LoginRequiredMixin, View):
+    """View for following (POST) and unfollowing (DELETE) a user, answering with the new state."""
+    raise_exception = True
+
+    def get_followed_user(self):
+        followed_user = get_object_or_404(User, username=self.kwargs['username'])
+        if followed_user == self.request.user:
+            raise Http404('You cannot follow yourself')
+        return followed_user
+
+    def post(self, request, *args, **kwargs):
+        followed_user = self.get_followed_user()
+        Follow.follow(request.user, followed_user)
+        return self.get_response(followed_user, True)
+
+    def delete(self, request, *args, **kwargs):
+        followed_user = self.get_followed_user()
+        Follow.unfollow(request.user, followed_user)
+        return self.get_response(followed_user, False)
+
+    @staticmethod
+    def get_response(followed_user, following):
+        followers_count = UserProfile.objects.filter(user=followed_user).values_list(
+            'followers_count', flat=True
+        ).first()
+        return JsonResponse({'following': following, 'followers_count': followers_count})
+
+
 class UserProfileEditView(LoginRequiredMixin, UpdateView):
     """View for editing user profiles."""
     model = UserProfile
@@ -217,88 +371,184 @@ class HashtagPostListView(AllPostsListView):
     """View for displaying posts with a specific hashtag."""
     template_name = 'explore_tags_list.html'
 
-    def get_queryset(self):
-        hashtag = self.kwargs['hashtag']
-        return Post.objects.filter(hashtags__name=f'{hashtag}')
+    def get_hashtag_ids(self):
+        # Hashtags match case-insensitively, through the index on LOWER(name)
+        if not hasattr(self, '_hashtag_ids'):
+            self._hashtag_ids = list(Hashtag.objects.alias(name_lower=Lower('name')).filter(
+                name_lower=self.kwargs['hashtag'].lower()
+            ).values_list('id', flat=True))
+        return self._hashtag_ids
+
+    def get_post_ids(self):
+        """Return the ids of the posts on the page, and whether there is a next page."""
+        cursor = self.request.GET.get(self.cursor_kwarg)
+        try:
+            values = KeysetPaginator(Post.objects.all(), self.paginate_by).decode_cursor(cursor) if cursor else None
+        except InvalidCursor:
+            raise Http404('Invalid page cursor.')
+
+        # Walk the (hashtag, created_at) index of the post/hashtag links instead of sorting all tagged posts
+        hashtag_ids = self.get_hashtag_ids()
+        links = PostHashtag.objects.filter(hashtag_id__in=hashtag_ids)
+        links_paginator = KeysetPaginator(links, self.paginate_by, ('-created_at', '-post_id'))
+        if values:
+            links = links.filter(links_paginator.get_keyset_filter(values))
+        # A post tagged with several spellings ('Tag' and 'tag') has a link for each of them, enough
+        # links are read to still find paginate_by + 1 distinct posts when every post has them all
+        limit = (self.paginate_by + 1) * max(len(hashtag_ids), 1)
+        post_ids = list(dict.fromkeys(
+            links.order_by(*links_paginator.ordering).values_list('post_id', flat=True)[:limit]
+        ))
+        return post_ids[:self.paginate_by], len(post_ids) > self.paginate_by
+
+    def get_hashtag_count(self):
+        """Return the number of posts with the hashtag, counted on the first page only, else None."""
+        if self.request.GET.get(self.cursor_kwarg):
+            return None
+        if not hasattr(self, '_hashtag_count'):
+            hashtag_ids = self.get_hashtag_ids()
+            links = PostHashtag.objects.filter(hashtag_id__in=hashtag_ids)
+            if len(hashtag_ids) > 1:
+                # Count the posts tagged with several spellings once
+                self._hashtag_count = links.aggregate(count=Count('post_id', distinct=True))['count']
+            else:
+                self._hashtag_count = links.count()
+        return self._hashtag_count
+
+    def get_etag_parts(self):
+        return [self.get_hashtag_count(), super().get_etag_parts()]
+
+    def get_page(self):
+        post_ids, has_next = self.get_post_ids()
+        posts_by_id = self.object_list.in_bulk(post_ids)
+        object_list = [posts_by_id[post_id] for post_id in post_ids if post_id in posts_by_id]
+        paginator = KeysetPaginator(self.object_list, self.paginate_by)
+        next_cursor = paginator.encode_cursor(object_list[-1]) if has_next and object_list else None
+        return KeysetPage(object_list, next_cursor)
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data()
         context['hashtag'] = self.kwargs['hashtag']
-        context['hashtag_count'] = self.get_queryset().count()
+        context['hashtag_count'] = self.get_hashtag_count()
         return context
 
 
-class PostLikesView(DetailView):
+class ExploreView(ListView):
+    """View for displaying the currently trending hashtags."""
+    template_name = 'explore.html'
+    context_object_name = 'trends'
+
+    def get_queryset(self):
+        return trending.top()
+
+
+class PostLikesView(KeysetPaginationMixin, ListView):
     """View for displaying likes on a post."""
     template_name = 'post_likes.html'
-    model = Post
-    context_object_name = 'post'
+    paginate_by = 50
 
-    def get_object(self, queryset=None):
-        obj = super().get_object(queryset)
-        obj.likes_users = obj.likes.all()
-        return obj
+    def get_queryset(self):
+        self.post = get_object_or_404(Post.objects.only('id', 'like_count'), pk=self.kwargs['pk'])
+        queryset = PostLike.objects.filter(post=self.post).select_related('user__userprofile').only(
+            'id', 'created_at', 'user__username', 'user__userprofile__avatar', 'user__userprofile__avatar_variants'
+        )
+        return queryset
 
+    def get_context_data(self, **kwargs):
+        page = self.paginate_keyset(self.object_list)
+        followed_likers = PostLike.followed_likers(self.request.user, [self.post.pk]).get(self.post.pk, [])
+
+        context = {
+            'post': self.post,
+            'likers': [like.user for like in page],
+            'next_cursor': page.next_cursor,
+            'followed_likers': followed_likers,
+            'other_likes_count': max(self.post.like_count - len(followed_likers), 0),
+        }
+        return context
 
-class UserFollowersView(ListView):
+
+class UserFollowersView(KeysetPaginationMixin, ListView):
     """View for displaying a user's followers."""
     template_name = 'users_listing.html'
-    context_object_name = 'followers'
-    extra_context = {'action': 'followers'}
+    action = 'followers'
+    paginate_by = 50
+    # Follow field pointing at the profile owner, and at the listed users
+    owner_field = 'following'
+    listed_field = 'follower'
 
     def get_queryset(self):
-        username = self.kwargs['username']
-        user = get_object_or_404(User, username=username)
-        queryset = Follow.objects.filter(following=user).select_related('follower')
-        follower_users = [user.follower for user in queryset]
-        return follower_users
+        owner = get_object_or_404(User.objects.only('id'), username=self.kwargs['username'])
+        listed = self.listed_field
+        queryset = Follow.objects.filter(**{self.owner_field: owner}).select_related(
+            f'{listed}__userprofile'
+        ).only(
+            'id', 'created_at', f'{listed}__username',
+            f'{listed}__userprofile__avatar', f'{listed}__userprofile__avatar_variants',
+        )
+        return queryset
 
-    def get_context_data(self, *, object_list=None, **kwargs):
-        context = super().get_context_data(object_list=None, **kwargs)
-        context['username'] = self.kwargs['username']
+    def get_context_data(self, **kwargs):
+        page = self.paginate_keyset(self.object_list)
+        users = [getattr(follow, self.listed_field) for follow in page]
+
+        # Whether the visitor follows each listed user, in one query for the whole page
+        viewer = self.request.user
+        followed_ids = set()
+        if viewer.is_authenticated and users:
+            followed_ids = set(Follow.objects.filter(
+                follower=viewer, following__in=[user.id for user in users]
+            ).values_list('following_id', flat=True))
+        for user in users:
+            user.is_followed = user.id in followed_ids
+
+        context = {
+            'users': users,
+            'next_cursor': page.next_cursor,
+            'username': self.kwargs['username'],
+            'action': self.action,
+        }
         return context
 
 
 class UserFollowingView(UserFollowersView):
     """View for displaying users that a user is following."""
-    extra_context = {'action': 'following'}
-
-    def get_queryset(self):
-        username = self.kwargs['username']
-        user = get_object_or_404(User, username=username)
-        queryset = Follow.objects.filter(follower=user).select_related('following')
-        follower_users = [user.following for user in queryset]
-        return follower_users
+    action = 'following'
+    owner_field = 'follower'
+    listed_field = 'following'
 
 
 class SearchView(FormView):
     template_name = 'search.html'
     form_class = SearchForm
+    paginate_by = 20
 
     def get(self, request, *args, **kwargs):
         context = self.get_context_data()
         form = self.get_form_class()
 
-        text = request.GET.get('text')
-        choice = request.GET.get('choice')
-
         form = form(request.GET) if request.GET else form()
 
         if form.is_valid():
             context['search_performed'] = True
+            text = form.cleaned_data['text']
+            choice = form.cleaned_data['choice']
 
             if choice == 'user':
-                users_result = User.objects.filter(
-                    Q(username__istartswith=text) |
-                    Q(username__icontains=text)
-                )
-                context['users_result'] = users_result
-                context['match'] = users_result.exists()
+                documents = search.search(SearchDocument.USER, text).values_list('user_id', flat=True)
+                page = Paginator(documents, self.paginate_by).get_page(request.GET.get('page'))
+                users = User.objects.select_related('userprofile').in_bulk(list(page))
+                context['users_result'] = [users[user_id] for user_id in page if user_id in users]
 
             elif choice == 'hashtag':
-                hashtags_result = Hashtag.objects.filter(name__icontains=f'{text}')
-                context['hashtags_result'] = hashtags_result
-                context['match'] = hashtags_result.exists()
+                # The label and the post count used for ranking are stored on the document
+                documents = search.search(SearchDocument.HASHTAG, text).only('label', 'popularity')
+                page = Paginator(documents, self.paginate_by).get_page(request.GET.get('page'))
+                context['hashtags_result'] = list(page)
+
+            context['page_obj'] = page
+            context['match'] = page.paginator.count > 0
+            context['query'] = urlencode({'text': text, 'choice': choice})
 
         context['form'] = form
         return self.render_to_response(context)
@@ -309,7 +559,9 @@ class NotificationListView(LoginRequiredMixin, ListView):
     context_object_name = 'notifications'
 
     def get_queryset(self):
-        queryset = Notification.objects.filter(recipient_user=self.request.user).select_related('action_user')
+        queryset = Notification.objects.filter(recipient_user=self.request.user).select_related(
+            'action_user__userprofile', 'action_comment'
+        )
         return queryset
 
     def post(self, request, *args, **kwargs):
@@ -317,13 +569,36 @@ class NotificationListView(LoginRequiredMixin, ListView):
         mark_all_as_read = request.POST.get('mark_all_as_read')
 
         if notification_read_id:
-            notification = Notification.objects.get(id=notification_read_id)
-            notification.is_read = not notification.is_read
-            notification.save()
+            notification = get_object_or_404(Notification, id=notification_read_id, recipient_user=self.request.user)
+            notification.set_read(not notification.is_read)
 
         if mark_all_as_read:
-            unread_notifications = Notification.objects.filter(recipient_user=self.request.user, is_read=False)
-            unread_notifications.update(is_read=True)
+            Notification.mark_all_as_read(self.request.user)
 
         return HttpResponseRedirect(reverse_lazy('notifications'))
 
+
+class NotificationStreamView(View):
+    """View streaming the unread count and new notifications of the user as server-sent events."""
+
+    async def get(self, request, *args, **kwargs):
+        user = await sync_to_async(get_user)(request)
+        if not user.is_authenticated:
+            raise PermissionDenied
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        if not hasattr(request, 'scope'):
+            # Outside of ASGI a never-ending stream would hold a worker thread, answer with the current state only
+            events = [event async for event in notifications.stream(user.pk, follow=False)]
+            return HttpResponse(''.join(events), content_type='text/event-stream', headers=headers)
+        return StreamingHttpResponse(
+            notifications.stream(user.pk), content_type='text/event-stream', headers=headers
+        )
+
+
+class MetricsView(View):
+    """View exposing the request metrics of this process to staff users and METRICS_TOKEN holders."""
+
+    def get(self, request, *args, **kwargs):
+        if not metrics.is_authorized(request):
+            raise Http404
+        return HttpResponse(metrics.registry.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -50,6 +50,8 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 
 MIDDLEWARE = [
+    'base.metrics.MetricsMiddleware',
+    'base.db.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -87,9 +89,27 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        # Keep connections open between requests, the SQLite pragmas are applied once per connection
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        # Seconds to wait for a lock held by another connection, the only place it is configured
+        'OPTIONS': {'timeout': 20},
+    },
+    # Read replicas are added here and listed in DATABASE_REPLICAS, e.g.
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.sqlite3',
+    #     'NAME': BASE_DIR / 'replica.sqlite3',
+    #     'CONN_MAX_AGE': 600,
+    #     'TEST': {'MIRROR': 'default'},
+    # },
 }
 
+# Aliases of DATABASES receiving the reads of GET requests
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['base.db.PrimaryReplicaRouter']
+# Seconds a client keeps reading from the primary after a write, so it sees its own changes
+DATABASE_REPLICA_PIN_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -133,6 +153,22 @@ STATIC_ROOT = BASE_DIR / 'static'
 MEDIA_URL = '/images/'
 MEDIA_ROOT = BASE_DIR / 'static/images'
 
+# Uploads are stored once under their content hash, see base/storage.py
+STORAGES = {
+    'default': {'BACKEND': 'base.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+# Hash uploads while they are received, small ones in memory and the rest in a temporary file
+FILE_UPLOAD_HANDLERS = [
+    'base.storage.HashingMemoryFileUploadHandler',
+    'base.storage.HashingTemporaryFileUploadHandler',
+]
+
+# Resized copies of uploaded images, generated in the background after upload
+IMAGE_DERIVATIVE_FORMAT = 'WEBP'
+IMAGE_DERIVATIVE_QUALITY = 80
+IMAGE_DERIVATIVE_WORKERS = 2
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -150,3 +186,48 @@ ACCOUNT_DEFAULT_HTTP_PROTOCOL = 'https'
 ACCOUNT_EMAIL_REQUIRED = True
 ACCOUNT_UNIQUE_EMAIL = True
 ACCOUNT_PRESERVE_USERNAME_CASING = False
+
+# Followed-posts timeline
+# Posts of authors with more followers than this are merged into the feed at read time
+# instead of being copied into every follower's timeline.
+TIMELINE_FANOUT_LIMIT = 5000
+# Number of recent posts copied into a timeline when a user follows someone
+TIMELINE_BACKFILL_SIZE = 100
+
+# Trending hashtags
+# Age at which a post counts half as much towards the trending score of its hashtags
+TRENDING_HALF_LIFE_HOURS = 24
+# Number of hashtags shown on the explore page
+TRENDING_HASHTAGS_LIMIT = 30
+# Hours between recomputations of the trends from all hashtags, which drop removed tags and deleted posts
+TRENDING_FULL_REBUILD_HOURS = 24
+
+# Request metrics
+# Add a Server-Timing header with the SQL, template and total time to every response
+METRICS_SERVER_TIMING = DEBUG
+# Bearer token a Prometheus scraper sends to read /metrics without a staff session, empty allows staff only
+METRICS_TOKEN = ''
+
+# Cache used for the rendered post card fragments, which are keyed by the post version, and
+# for the user and site versions validating conditional GET requests.
+# Use a shared backend such as Redis or Memcached when running several processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'photoshare',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+# Live notifications
+# The file broker tails a spool file so notifications published by the process_notifications
+# worker reach the event streams of every ASGI worker on this host. Use
+# base.broker.InProcessBroker when a single process both publishes and serves the streams.
+NOTIFICATION_BROKER = {
+    'BACKEND': 'base.broker.FileBroker',
+    'OPTIONS': {'poll_interval': 0.5},
+}
+
+# HTTP caching
+# Seconds anonymous feed, profile and post pages may be stored by browsers and shared caches
+HTTP_CACHE_ANONYMOUS_MAX_AGE = 30
@@ -7,10 +7,12 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from base import storage
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path('', include('base.urls')),
     path('accounts/', include('allauth.urls')),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+urlpatterns += static(settings.MEDIA_URL, view=storage.serve, document_root=settings.MEDIA_ROOT)
\ No newline at end of file